@@ -4,17 +4,48 @@ import pathlib
 from discord import utils
 
 from config import TOKEN
-from src import bot
+from src import bot, create_tables, engine
+from src.utils.channels import ChannelCache
+from src.utils.feeds import FeedPool
+from src.utils.http import create_session
+from src.utils.jobs import JobQueue
+from src.utils.outbox import Outbox
+from src.utils.webhooks import WebhookCache
 
 
 async def main():
-    extensions = pathlib.Path("src/extensions").glob("*.py")
-
-    for extension in extensions:
-        await bot.load_extension(f"src.extensions.{extension.stem}")
-
-    utils.setup_logging()
-    await bot.start(TOKEN)
+    await create_tables()
+
+    feeds = FeedPool()
+
+    try:
+        # The session is closed after the bot, so nothing is left using it on the way out
+        async with create_session() as session, bot:
+            bot.session = session
+            bot.feeds = feeds
+            bot.webhooks = WebhookCache(bot)
+            bot.outbox = Outbox(bot.webhooks)
+            bot.channel_cache = ChannelCache()
+            bot.jobs = JobQueue()
+
+            extensions = pathlib.Path("src/extensions").glob("*.py")
+
+            for extension in extensions:
+                await bot.load_extension(f"src.extensions.{extension.stem}")
+
+            utils.setup_logging()
+
+            bot.outbox.start()
+            bot.jobs.start()
+
+            try:
+                await bot.start(TOKEN)
+            finally:
+                await bot.jobs.close()
+                await bot.outbox.close()
+    finally:
+        feeds.close()
+        await engine.dispose()
 
 
 if __name__ == "__main__":
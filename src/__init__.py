@@ -1,7 +1,8 @@
 import os
 
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+import sqlalchemy as sa
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 
 from .models.database import Base
 
@@ -10,10 +11,44 @@ url = os.getenv("DATABASE_URL")
 if not url:
     raise ValueError("DATABASE_URL is not set")
 
-engine = create_engine(url, echo=True)
-Base.metadata.create_all(engine)
-
-Session = sessionmaker(bind=engine, autoflush=True)
+# The DATABASE_URL is shared with alembic, which runs on the sync driver,
+#  so swap in the async driver for the bot itself.
+_url = make_url(url)
+if _url.drivername in ("postgresql", "postgresql+psycopg2"):
+    _url = _url.set(drivername="postgresql+asyncpg")
+
+engine = create_async_engine(_url, echo=True)
+
+# Objects are used after their session closes all over the cogs/views,
+#  and refreshing them would require IO, so don't expire on commit.
+Session = async_sessionmaker(bind=engine, autoflush=True, expire_on_commit=False)
+
+
+# create_all only makes tables that don't exist yet, so columns added to (or changed on) existing tables since
+#  are brought in here. Each one has to be safe to run against a database that already has it.
+MIGRATIONS = [
+    # Per subscription notification roles
+    "ALTER TABLE manga ADD COLUMN IF NOT EXISTS role_id BIGINT",
+    "ALTER TABLE nyaa ADD COLUMN IF NOT EXISTS role_id BIGINT",
+    # Incremental MangaDex polling
+    "ALTER TABLE manga ADD COLUMN IF NOT EXISTS latest_published_at TIMESTAMP WITH TIME ZONE",
+    "ALTER TABLE manga ADD COLUMN IF NOT EXISTS polled_at TIMESTAMP WITH TIME ZONE",
+    # Webhook posting, first made with 32 bit snowflakes
+    "ALTER TABLE feed_webhook ALTER COLUMN guild_id TYPE BIGINT",
+    "ALTER TABLE feed_webhook ALTER COLUMN channel_id TYPE BIGINT",
+    "ALTER TABLE feed_webhook ALTER COLUMN webhook_id TYPE BIGINT",
+    # Precomputed weekly occurrences
+    "ALTER TABLE weekly ADD COLUMN IF NOT EXISTS next_occurrence INTEGER",
+    "CREATE INDEX IF NOT EXISTS ix_weekly_next_occurrence ON weekly (next_occurrence)",
+]
+
+
+async def create_tables():
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+        for migration in MIGRATIONS:
+            await conn.execute(sa.text(migration))
 
 
 # Ordering matters here due to circular imports
@@ -1,4 +1,23 @@
+import aiohttp
 from discord.ext import commands
 from discord.flags import Intents
 
-bot = commands.Bot(command_prefix="?", intents=Intents.all())
+from src.utils.channels import ChannelCache
+from src.utils.feeds import FeedPool
+from src.utils.jobs import JobQueue
+from src.utils.outbox import Outbox
+from src.utils.webhooks import WebhookCache
+
+
+class Himari(commands.Bot):
+    # Shared HTTP client, feed parsing pool, outgoing message queue (and its webhooks),
+    #  channel lookups and scheduled jobs, all set up in main.py before the extensions are loaded
+    session: aiohttp.ClientSession
+    feeds: FeedPool
+    outbox: Outbox
+    webhooks: WebhookCache
+    channel_cache: ChannelCache
+    jobs: JobQueue
+
+
+bot = Himari(command_prefix="?", intents=Intents.all())
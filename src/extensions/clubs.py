@@ -1,6 +1,7 @@
 import discord
 import sqlalchemy as sa
 from discord.ext import commands
+from sqlalchemy.orm import selectinload
 
 from src import Session
 from src.models.database import Club, ClubMember
@@ -22,10 +23,12 @@ class ClubCog(commands.GroupCog, name="club", description="Commands to manage cl
                 "This command must be used in a server."
             )
 
-        with Session.begin() as session:
-            club = session.execute(
-                sa.select(Club).filter(
-                    Club.name == name, Club.guild_id == interaction.guild.id
+        async with Session.begin() as session:
+            club = (
+                await session.execute(
+                    sa.select(Club)
+                    .filter(Club.name == name, Club.guild_id == interaction.guild.id)
+                    .options(selectinload(Club.members))
                 )
             ).scalar_one_or_none()
 
@@ -56,10 +59,12 @@ class ClubCog(commands.GroupCog, name="club", description="Commands to manage cl
                 "This command must be used in a server."
             )
 
-        with Session.begin() as session:
-            club = session.execute(
-                sa.select(Club).filter(
-                    Club.name == name, Club.guild_id == interaction.guild.id
+        async with Session.begin() as session:
+            club = (
+                await session.execute(
+                    sa.select(Club)
+                    .filter(Club.name == name, Club.guild_id == interaction.guild.id)
+                    .options(selectinload(Club.members))
                 )
             ).scalar_one_or_none()
 
@@ -77,9 +82,9 @@ class ClubCog(commands.GroupCog, name="club", description="Commands to manage cl
                 )
 
             for member in club.members:
-                session.delete(member)
+                await session.delete(member)
 
-            session.delete(club)
+            await session.delete(club)
 
         await interaction.response.send_message(f"Deleted club {name}")
 
@@ -94,10 +99,12 @@ class ClubCog(commands.GroupCog, name="club", description="Commands to manage cl
                 "This command must be used in a server."
             )
 
-        with Session.begin() as session:
-            club = session.execute(
-                sa.select(Club).filter(
-                    Club.name == name, Club.guild_id == interaction.guild.id
+        async with Session.begin() as session:
+            club = (
+                await session.execute(
+                    sa.select(Club)
+                    .filter(Club.name == name, Club.guild_id == interaction.guild.id)
+                    .options(selectinload(Club.members))
                 )
             ).scalar_one_or_none()
 
@@ -127,10 +134,12 @@ class ClubCog(commands.GroupCog, name="club", description="Commands to manage cl
             )
             return
 
-        with Session.begin() as session:
-            club = session.execute(
-                sa.select(Club).filter(
-                    Club.name == name, Club.guild_id == interaction.guild.id
+        async with Session.begin() as session:
+            club = (
+                await session.execute(
+                    sa.select(Club)
+                    .filter(Club.name == name, Club.guild_id == interaction.guild.id)
+                    .options(selectinload(Club.members))
                 )
             ).scalar_one_or_none()
 
@@ -142,7 +151,7 @@ class ClubCog(commands.GroupCog, name="club", description="Commands to manage cl
                 await interaction.response.send_message(f"You are not in club {name}")
                 return
 
-            session.execute(
+            await session.execute(
                 sa.delete(ClubMember).filter(
                     ClubMember.user_id == interaction.user.id,
                     ClubMember.club_id == club.id,
@@ -159,14 +168,14 @@ class ClubCog(commands.GroupCog, name="club", description="Commands to manage cl
                 "This command must be used in a server."
             )
 
-        with Session.begin() as session:
+        async with Session.begin() as session:
             clubs = (
-                session.execute(
-                    sa.select(Club).filter(Club.guild_id == interaction.guild.id)
+                await session.scalars(
+                    sa.select(Club)
+                    .filter(Club.guild_id == interaction.guild.id)
+                    .options(selectinload(Club.members))
                 )
-                .scalars()
-                .all()
-            )
+            ).all()
 
             if not clubs:
                 return await interaction.response.send_message("No clubs exist")
@@ -195,10 +204,12 @@ class ClubCog(commands.GroupCog, name="club", description="Commands to manage cl
                 "This command must be used in a thread in a server."
             )
 
-        with Session.begin() as session:
-            club = session.execute(
-                sa.select(Club).filter(
-                    Club.name == name, Club.guild_id == interaction.guild.id
+        async with Session.begin() as session:
+            club = (
+                await session.execute(
+                    sa.select(Club)
+                    .filter(Club.name == name, Club.guild_id == interaction.guild.id)
+                    .options(selectinload(Club.members))
                 )
             ).scalar_one_or_none()
 
@@ -4,6 +4,7 @@ import string
 import discord
 import sqlalchemy as sa
 from discord.ext import commands
+from sqlalchemy.orm import selectinload
 
 from src import Session
 from src.models.database import Countdown, CountdownImage
@@ -39,12 +40,12 @@ class CountdownCog(
                 "This command must be used in a server."
             )
 
-        with Session.begin() as db:
-            countdown = db.execute(
+        async with Session.begin() as db:
+            countdown = await db.scalar(
                 sa.select(Countdown).where(
                     Countdown.lookup == name, Countdown.guild_id == interaction.guild.id
                 )
-            ).scalar()
+            )
 
             if countdown is not None:
                 return await interaction.response.send_message(
@@ -81,12 +82,12 @@ class CountdownCog(
                 "This command must be used in a server."
             )
 
-        with Session.begin() as db:
-            countdown = db.execute(
+        async with Session.begin() as db:
+            countdown = await db.scalar(
                 sa.select(Countdown).where(
                     Countdown.lookup == name, Countdown.guild_id == interaction.guild.id
                 )
-            ).scalar()
+            )
 
             if countdown is None:
                 return await interaction.response.send_message(
@@ -101,7 +102,7 @@ class CountdownCog(
                     "You are not the creator of that countdown.", ephemeral=True
                 )
 
-            db.delete(countdown)
+            await db.delete(countdown)
 
         await interaction.response.send_message(
             f"Countdown `{name}` removed.", ephemeral=True
@@ -120,10 +121,15 @@ class CountdownCog(
                 "This command must be used in a server."
             )
 
-        with Session.begin() as db:
-            countdown = db.execute(
-                sa.select(Countdown).where(
-                    Countdown.lookup == name, Countdown.guild_id == interaction.guild.id
+        async with Session.begin() as db:
+            countdown = (
+                await db.execute(
+                    sa.select(Countdown)
+                    .where(
+                        Countdown.lookup == name,
+                        Countdown.guild_id == interaction.guild.id,
+                    )
+                    .options(selectinload(Countdown.images))
                 )
             ).scalar_one_or_none()
 
@@ -153,16 +159,14 @@ class CountdownCog(
                 "This command must be used in a server."
             )
 
-        with Session.begin() as db:
+        async with Session.begin() as db:
             countdowns = (
-                db.execute(
+                await db.scalars(
                     sa.select(Countdown).where(
                         Countdown.guild_id == interaction.guild.id
                     )
                 )
-                .scalars()
-                .all()
-            )
+            ).all()
 
             if not countdowns:
                 return await interaction.response.send_message(
@@ -202,12 +206,12 @@ class CountdownCog(
             )
             return
 
-        with Session.begin() as db:
-            countdown = db.execute(
+        async with Session.begin() as db:
+            countdown = await db.scalar(
                 sa.select(Countdown).where(
                     Countdown.lookup == name, Countdown.guild_id == interaction.guild.id
                 )
-            ).scalar()
+            )
 
             if countdown is None:
                 return await interaction.response.send_message(
@@ -219,12 +223,12 @@ class CountdownCog(
                     "You are not the creator of that countdown.", ephemeral=True
                 )
 
-            image = db.execute(
+            image = await db.scalar(
                 sa.select(CountdownImage).where(
                     CountdownImage.url == url,
                     CountdownImage.countdown_id == countdown.id,
                 )
-            ).scalar()
+            )
 
             if image is not None:
                 return await interaction.response.send_message(
@@ -232,7 +236,7 @@ class CountdownCog(
                     ephemeral=True,
                 )
 
-            countdown.images.append(CountdownImage(url=url))
+            db.add(CountdownImage(countdown_id=countdown.id, url=url))
 
         await interaction.response.send_message(
             f"Image {url} added to countdown `{name}`.", ephemeral=True
@@ -255,12 +259,12 @@ class CountdownCog(
             )
             return
 
-        with Session.begin() as db:
-            countdown = db.execute(
+        async with Session.begin() as db:
+            countdown = await db.scalar(
                 sa.select(Countdown).where(
                     Countdown.lookup == name, Countdown.guild_id == interaction.guild.id
                 )
-            ).scalar()
+            )
 
             if countdown is None:
                 return await interaction.response.send_message(
@@ -272,12 +276,12 @@ class CountdownCog(
                     "You are not the creator of that countdown.", ephemeral=True
                 )
 
-            image = db.execute(
+            image = await db.scalar(
                 sa.select(CountdownImage).where(
                     CountdownImage.url == url,
                     CountdownImage.countdown_id == countdown.id,
                 )
-            ).scalar()
+            )
 
             if image is None:
                 return await interaction.response.send_message(
@@ -285,7 +289,7 @@ class CountdownCog(
                     ephemeral=True,
                 )
 
-            db.delete(image)
+            await db.delete(image)
 
         await interaction.response.send_message(
             f"Image {url} removed from countdown `{name}`.", ephemeral=True
@@ -3,18 +3,18 @@ import sqlalchemy as sa
 from discord.ext import commands
 
 from src import Session
+from src.bot import Himari
 from src.models.database import Daily
 from src.utils.daily import DailyHandler
 
 
 class DailyCog(commands.GroupCog, name="daily"):
-    def __init__(self, bot: commands.Bot):
+    def __init__(self, bot: Himari):
         self.bot = bot
-        self._daily_handler = DailyHandler()
+        self._daily_handler = DailyHandler(bot.jobs)
 
     async def cog_load(self) -> None:
-        self._daily_handler = DailyHandler()
-        self._daily_handler.schedule()
+        await self._daily_handler.start()
 
     async def cog_unload(self) -> None:
         self._daily_handler.cancel()
@@ -28,10 +28,10 @@ class DailyCog(commands.GroupCog, name="daily"):
         """
         Add a daily counter, which will ping you every 24 hours, starting from when this command is ran.
         """
-        with Session.begin() as db:
-            daily = db.execute(
+        async with Session.begin() as db:
+            daily = await db.scalar(
                 sa.select(Daily).where(Daily.creator_id == interaction.user.id)
-            ).scalar()
+            )
 
             if daily is not None:
                 return await interaction.response.send_message(
@@ -51,31 +51,31 @@ class DailyCog(commands.GroupCog, name="daily"):
 
         await interaction.response.send_message("Daily counter added.", ephemeral=True)
 
-        self._daily_handler.schedule()
+        await self._daily_handler.schedule(interaction.user.id, int(timestamp))
 
     @discord.app_commands.command(description="Remove your daily counter.")
     async def delete(self, interaction: discord.Interaction):
         """
         Remove your daily counter.
         """
-        with Session.begin() as db:
-            daily = db.execute(
+        async with Session.begin() as db:
+            daily = await db.scalar(
                 sa.select(Daily).where(Daily.creator_id == interaction.user.id)
-            ).scalar()
+            )
 
             if daily is None:
                 return await interaction.response.send_message(
                     "You do not have a daily counter setup.", ephemeral=True
                 )
 
-            db.delete(daily)
+            await db.delete(daily)
 
         await interaction.response.send_message(
             "Daily counter removed.", ephemeral=True
         )
 
-        self._daily_handler.schedule()
+        await self._daily_handler.unschedule(interaction.user.id)
 
 
-async def setup(bot: commands.Bot):
+async def setup(bot: Himari):
     await bot.add_cog(DailyCog(bot))
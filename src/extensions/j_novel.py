@@ -1,44 +1,65 @@
+import asyncio
 import logging
-from typing import AsyncGenerator, Union, cast
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Union
 
 import aiohttp
 import discord
-import feedparser
 import sqlalchemy as sa
 from discord.ext import commands, tasks
+from sqlalchemy.dialects.postgresql import insert
 
 from src import Session
-from src.models.database import JNovel
-from src.utils import get_channel
-from src.utils.j_novel import search_series
+from src.bot import Himari
+from src.models.database import JNovel, PollCursor
+from src.utils.feeds import FeedEntry
+from src.utils.http import ConditionalGet, retry_after
+from src.utils.j_novel import Catalog, get_events
+from src.utils.scheduler import AdaptiveSchedule, PollConfig
 from src.views.j_novel import JNovelSearch
 
 BASE = "https://labs.j-novel.club/feed/series/{}.rss"
+# Per series, the loop itself just ticks over often enough to catch whichever is due next
+POLL = PollConfig.from_env("J_NOVEL", minimum=30, maximum=900)
+
+# Set J_NOVEL_MODE=events to watch the one global release listing, rather than every series' feed.
+#  The feeds are then only fetched when the listing says a followed series has a release, and
+#  every so often on their own, to pick up anything the listing missed.
+EVENTS = os.getenv("J_NOVEL_MODE", "series").lower() == "events"
+EVENTS_POLL = PollConfig.from_env("J_NOVEL_EVENTS", minimum=60, maximum=600)
+RECONCILE = PollConfig.from_env("J_NOVEL_RECONCILE", minimum=60 * 60, maximum=6 * 60 * 60)
+EVENTS_SOURCE = "j_novel_events"
+# Where the listing's read from the very first time, before there's a cursor
+EVENTS_LOOKBACK = timedelta(hours=1)
+# A series the listing says has a release is fetched this often, until its feed shows it or this long's passed
+EXPEDITE_EVERY = 60
+EXPEDITE_WINDOW = 30 * 60
+# Most series feeds fetched at once
+FETCH_CONCURRENCY = 4
 
 
 logger = logging.getLogger(__name__)
 
 
-async def get_latest(series: str, latest: str | None) -> AsyncGenerator[feedparser.FeedParserDict, None]:
-    async with aiohttp.ClientSession() as session:
-        async with session.get(BASE.format(series)) as resp:
-            if resp.status > 299:
-                return
-
-            data = await resp.read()
+def get_latest(entries: list[FeedEntry], latest: str | None) -> list[FeedEntry]:
+    """
+    Get the entries newer than `latest`, out of the (newest first) entries of a series.
+    """
+    results = []
 
-    feed = feedparser.parse(data)
-
-    for entry in feed.entries:
+    for entry in entries:
         # This one's a bit special, only give us the latest one, and then stop.
         if latest is None:
-            yield entry
+            results.append(entry)
             break
 
         if entry.id == latest:
             break
 
-        yield entry
+        results.append(entry)
+
+    return results
 
 
 @discord.app_commands.guild_only()
@@ -47,14 +68,27 @@ class JNovelCog(
     name="jnovel",
     description="Commands to manage J-Novel Club RSS feed stuff.",
 ):
-    def __init__(self, bot: commands.Bot):
+    def __init__(self, bot: Himari):
         self.bot = bot
+        self._schedule = AdaptiveSchedule(RECONCILE if EVENTS else POLL)
+        self._events = AdaptiveSchedule(EVENTS_POLL)
+        self._catalog = Catalog()
+        self._rss = ConditionalGet()
+        # The last parse of each series' feed, so an unchanged feed can still be fanned out to new follows
+        self._entries: dict[str, list[FeedEntry]] = {}
 
     async def cog_load(self) -> None:
+        self._catalog.load()
+        self.refresh_catalog.start()
         self.j_novel.start()
 
+        if EVENTS:
+            self.events.start()
+
     async def cog_unload(self) -> None:
+        self.refresh_catalog.cancel()
         self.j_novel.cancel()
+        self.events.cancel()
 
     @discord.app_commands.command(description="Add a J-Novel series to follow and post to a channel.")
     @discord.app_commands.describe(
@@ -74,23 +108,34 @@ class JNovelCog(
             await interaction.response.send_message("This command must be used in a server.")
             return
 
-        results = await search_series(series)
+        send = interaction.response.send_message
+
+        # Nothing to search through yet, so this once it has to wait on the catalog. Fetching it takes
+        #  longer than Discord waits for a response, so the response is deferred and followed up instead.
+        if not self._catalog:
+            await interaction.response.defer(ephemeral=True, thinking=True)
+            await self._catalog.refresh(self.bot.session)
+            send = interaction.followup.send
+
+        # Picked from the autocomplete, so it's an exact series rather than a search
+        exact = self._catalog.get(series)
+        results = [exact] if exact is not None else self._catalog.search(series)
 
         if not results:
-            return await interaction.response.send_message("No results found.", ephemeral=True)
+            return await send("No results found.", ephemeral=True)
 
         if len(results) == 1:
             result = results[0]
 
-            with Session.begin() as db:
-                db_series = db.execute(
-                    sa.select(JNovel).filter(JNovel.series == result.id, JNovel.guild_id == interaction.guild.id)
+            async with Session.begin() as db:
+                db_series = (
+                    await db.execute(
+                        sa.select(JNovel).filter(JNovel.series == result.id, JNovel.guild_id == interaction.guild.id)
+                    )
                 ).scalar_one_or_none()
 
                 if db_series is not None:
-                    return await interaction.response.send_message(
-                        "That series is already in the follow list.", ephemeral=True
-                    )
+                    return await send("That series is already in the follow list.", ephemeral=True)
 
                 db.add(
                     JNovel(
@@ -102,55 +147,223 @@ class JNovelCog(
                     )
                 )
 
-                await interaction.response.send_message(f"Added {result.title} to the follow list.", ephemeral=True)
+                await send(f"Added {result.title} to the follow list.", ephemeral=True)
         else:
             view = JNovelSearch(results, interaction.user.id, channel)
 
-            await interaction.response.send_message("Select the series you want to follow.", view=view, ephemeral=True)
+            await send("Select the series you want to follow.", view=view, ephemeral=True)
 
-    @tasks.loop(seconds=5)
-    async def j_novel(self):
+    @follow.autocomplete("series")
+    async def series_autocomplete(self, interaction: discord.Interaction, current: str):
+        return [
+            discord.app_commands.Choice(name=series.title[:100], value=series.id)
+            for series in self._catalog.search(current)[:25]
+        ]
+
+    # Checked hourly, but only actually fetched again once it's older than CATALOG_TTL
+    @tasks.loop(hours=1)
+    async def refresh_catalog(self):
+        try:
+            # A snapshot from disk that's still fresh also saves fetching it again on start up
+            await self._catalog.refresh(self.bot.session)
+            logger.debug(f"J-Novel catalog has {len(self._catalog)} series")
+        except Exception as e:
+            logger.error("Error refreshing the J-Novel catalog", exc_info=e)
+
+    async def fetch(self, series: str) -> int:
+        """
+        Fetch a series' feed if it's changed, returning how many entries it has that it didn't last time.
+        """
+        body = await self._rss.fetch(self.bot.session, BASE.format(series))
+
+        if body is None:
+            return 0
+
+        entries = await self.bot.feeds.parse(body)
+        previous = self._entries.get(series)
+        self._entries[series] = entries
+
+        if previous is None:
+            return 0
+
+        seen = {entry.id for entry in previous}
+        return sum(entry.id not in seen for entry in entries)
+
+    async def fan_out(self, feed: JNovel) -> list[tuple[str, asyncio.Future]]:
+        """
+        Queue up the new entries of a series for one of its follows, oldest first.
+        """
+        guild = self.bot.get_guild(feed.guild_id)
+
+        if guild is None:
+            return []
+
+        channel = await self.bot.channel_cache.get(guild, feed.channel_id)
+
+        if channel is None:
+            return []
+
+        queued = []
+
+        for entry in reversed(get_latest(self._entries.get(feed.series, []), feed.latest)):
+            embed = discord.Embed(
+                title=entry.title,
+                url=entry.link,
+                color=discord.Color.blurple(),
+            )
+
+            if entry.cover:
+                embed.set_image(url=entry.cover)
+
+            queued.append((entry.id, self.bot.outbox.send(channel, embed=embed)))
+
+        return queued
+
+    @tasks.loop(seconds=60)
+    async def events(self):
         await self.bot.wait_until_ready()
 
         try:
-            with Session.begin() as db:
-                feeds = db.execute(sa.select(JNovel)).scalars().all()
+            # Events only name the series by their v2 id, which needs the catalog to match up
+            if not self._catalog:
+                return
+
+            async with Session() as db:
+                followed = set((await db.scalars(sa.select(JNovel.series).distinct())).all())
+                cursor = await db.scalar(sa.select(PollCursor.cursor).where(PollCursor.source == EVENTS_SOURCE))
 
-                for feed in feeds:
-                    guild = self.bot.get_guild(feed.guild_id)
-                    if guild is None:
-                        break
+            now = datetime.now(timezone.utc)
+            since = datetime.fromisoformat(cursor) if cursor is not None else now - EVENTS_LOOKBACK
 
-                    channel = await get_channel(guild, feed.channel_id)
+            try:
+                events = await get_events(self.bot.session, since, now)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                headers = e.headers if isinstance(e, aiohttp.ClientResponseError) else None
+                self._events.failed(EVENTS_SOURCE, retry_after(headers))
+                logger.warning(f"Error fetching J-Novel events: {e!r}")
+                return
 
-                    if channel is None:
-                        break
+            released = 0
 
-                    results = [r async for r in get_latest(feed.series, feed.latest)]
-                    entry = None
+            # The feeds themselves do the posting, through each follow's cursor, so nothing's posted twice
+            for event in events:
+                # The last event from before is seen again, its series has already been expedited
+                if cursor is not None and event.launch <= since:
+                    continue
 
-                    for entry in reversed(results):
-                        embed = discord.Embed(
-                            title=entry.title,
-                            url=entry.link,
-                            color=discord.Color.blurple(),
-                        )
+                series = self._catalog.by_api_id(event.series) if event.series is not None else None
 
-                        cover = next(
-                            filter(lambda link: link.rel == "enclosure", entry.links),
-                            None,
-                        )
+                if series is not None and series.id in followed:
+                    self._schedule.expedite(series.id, window=EXPEDITE_WINDOW, every=EXPEDITE_EVERY)
+                    released += 1
 
-                        if cover:
-                            embed.set_image(url=cover.href)
+            self._events.record(EVENTS_SOURCE, new=released)
 
-                        await channel.send(embed=embed)
+            if events:
+                # The listing's asked for inclusively, so the last event gets seen again, which is harmless
+                latest = events[-1].launch.isoformat()
 
-                    if entry is not None:
-                        feed.latest = cast(str, entry.id)
+                async with Session.begin() as db:
+                    await db.execute(
+                        insert(PollCursor)
+                        .values(source=EVENTS_SOURCE, cursor=latest)
+                        .on_conflict_do_update(index_elements=[PollCursor.source], set_={"cursor": latest})
+                    )
+        except Exception as e:
+            logger.error("Error in j_novel events loop", exc_info=e)
+        finally:
+            self.events.change_interval(seconds=max(self._events.delay(EVENTS_SOURCE), 1))
+
+    @tasks.loop(seconds=5)
+    async def j_novel(self):
+        await self.bot.wait_until_ready()
+
+        try:
+            # Snapshot the follows, the connection shouldn't be held while we're fetching feeds
+            async with Session() as db:
+                feeds = (await db.scalars(sa.select(JNovel))).all()
+
+            # Follows grouped by series, so each series is only fetched the once however many guilds follow it
+            by_series: dict[str, list[JNovel]] = {}
+
+            for feed in feeds:
+                by_series.setdefault(feed.series, []).append(feed)
+
+            self._schedule.retain(by_series)
+
+            for series in self._entries.keys() - by_series.keys():
+                del self._entries[series]
+                self._rss.forget(BASE.format(series))
+
+            # Only the series whose schedule says they're due get fetched this tick
+            due = [series for series in by_series if self._schedule.due(series)]
+
+            if not due:
+                return
+
+            # Cursor updates, keyed by JNovel.id, written back in one go at the end
+            updates: dict[int, str] = {}
+            # How many new entries each series turned up, and the Retry-After of those that failed
+            published: dict[str, int] = {}
+            failed: dict[str, float | None] = {}
+            # Queued posts per JNovel.id, oldest first
+            posts: dict[int, list[tuple[str, asyncio.Future]]] = {}
+
+            slots = asyncio.Semaphore(FETCH_CONCURRENCY)
+
+            async def fetch(series: str):
+                async with slots:
+                    try:
+                        published[series] = await self.fetch(series)
+                    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                        headers = e.headers if isinstance(e, aiohttp.ClientResponseError) else None
+                        failed[series] = retry_after(headers)
+                        logger.warning(f"Error fetching J-Novel series {series}: {e!r}")
+                    except Exception as e:
+                        failed[series] = None
+                        self._rss.forget(BASE.format(series))
+                        logger.error(f"Error fetching J-Novel series {series}", exc_info=e)
+
+            try:
+                await asyncio.gather(*(fetch(series) for series in due))
+
+                # Every follow of a series that was fetched gets its own go, one going wrong doesn't stop the rest
+                for series in due:
+                    if series in failed:
+                        continue
+
+                    for feed in by_series[series]:
+                        try:
+                            posts[feed.id] = await self.fan_out(feed)
+                        except Exception as e:
+                            logger.error(f"Error posting J-Novel series {series} for {feed.id}", exc_info=e)
+            finally:
+                queued = [delivered for entries in posts.values() for _, delivered in entries]
+                await asyncio.gather(*queued, return_exceptions=True)
+
+                # Cursors only move up to the first post that didn't make it, so it gets another go
+                for id, entries in posts.items():
+                    for entry_id, delivered in entries:
+                        if delivered.cancelled() or delivered.exception() is not None:
+                            break
+
+                        updates[id] = entry_id
+
+                for series, after in failed.items():
+                    self._schedule.failed(series, after)
+
+                for series, new in published.items():
+                    self._schedule.record(series, new=new)
+
+                if updates:
+                    async with Session.begin() as db:
+                        await db.execute(
+                            sa.update(JNovel),
+                            [{"id": id, "latest": latest} for id, latest in updates.items()],
+                        )
         except Exception as e:
             logger.error("Error in j_novel loop", exc_info=e)
 
 
-async def setup(bot: commands.Bot):
+async def setup(bot: Himari):
     await bot.add_cog(JNovelCog(bot))
@@ -1,21 +1,37 @@
+import asyncio
 import io
 import json
 import logging
+import time
+from datetime import datetime
 from typing import TypedDict, Union
 
-import aiohttp
 import discord
 import sqlalchemy as sa
 from discord.ext import commands, tasks
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import selectinload
 
 from src import Session
-from src.models.database import Manga
-from src.utils import get_channel
-from src.utils.mangadex import Chapter, latest_chapter, search_manga
-from src.views.mangadex import MangaNotificationView, MangaSearch
+from src.bot import Himari
+from src.models.database import Manga, PollCursor
+from src.utils.covers import CoverCache
+from src.utils.mangadex import (
+    BATCH_SIZE,
+    OVERLAP,
+    Chapter,
+    ChapterFetcher,
+    search_manga,
+)
+from src.utils.roles import PER_SUBSCRIPTION, RoleSync
+from src.utils.scheduler import AdaptiveSchedule, PollConfig
+from src.views.mangadex import MangaNotificationView, MangaSearch, determine_followers
 
 logger = logging.getLogger(__name__)
 
+SOURCE = "mangadex"
+POLL = PollConfig.from_env("MANGADEX", minimum=60, maximum=600)
+
 
 class MangadexGroupedItem(TypedDict):
     id: str
@@ -26,14 +42,57 @@ class MangaDBItem(TypedDict):
     mangas: list[MangadexGroupedItem]
 
 
+async def load_follows() -> dict[str, list[Manga]]:
+    """
+    Every manga follow, with its followers, grouped by MangaDex id to limit the requests we make to MangaDex.
+
+    Followers come along in the one extra query, rather than one per manga.
+    """
+    async with Session() as db:
+        all_manga = (
+            await db.scalars(
+                sa.select(Manga).options(selectinload(Manga.followers)).order_by(Manga.mangadex_id, Manga.id)
+            )
+        ).all()
+
+    by_mangadex_id: dict[str, list[Manga]] = {}
+
+    for manga in all_manga:
+        by_mangadex_id.setdefault(manga.mangadex_id, []).append(manga)
+
+    return by_mangadex_id
+
+
+def cursor_source(mangadex_id: str) -> str:
+    return f"{SOURCE}:{mangadex_id}"
+
+
+async def load_cursors() -> dict[str, datetime]:
+    """
+    How far along each manga's chapters have been fetched, by MangaDex id.
+    """
+    async with Session() as db:
+        rows = (
+            await db.execute(
+                sa.select(PollCursor.source, PollCursor.cursor).where(PollCursor.source.startswith(f"{SOURCE}:"))
+            )
+        ).all()
+
+    return {source.removeprefix(f"{SOURCE}:"): datetime.fromisoformat(cursor) for source, cursor in rows}
+
+
 @discord.app_commands.guild_only()
 class MangaDexCog(
     commands.GroupCog,
     name="mangadex",
     description="Commands to manage MangaDex RSS feed stuff.",
 ):
-    def __init__(self, bot: commands.Bot) -> None:
+    def __init__(self, bot: Himari) -> None:
         self.bot = bot
+        self._schedule = AdaptiveSchedule(POLL)
+        self._roles = RoleSync()
+        self._fetcher = ChapterFetcher()
+        self._covers = CoverCache()
 
     async def cog_load(self) -> None:
         self.mangadex.start()
@@ -56,7 +115,7 @@ class MangaDexCog(
             await interaction.response.send_message("This command must be used in a server.", ephemeral=True)
             return
 
-        mangas = await search_manga(manga)
+        mangas = await search_manga(self.bot.session, manga)
 
         if len(mangas) == 0:
             await interaction.response.send_message("No manga found with that name.", ephemeral=True)
@@ -65,9 +124,11 @@ class MangaDexCog(
         if len(mangas) == 1:
             _manga = mangas[0]
 
-            with Session.begin() as db:
-                db_manga = db.execute(
-                    sa.select(Manga).filter(Manga.mangadex_id == _manga.id, Manga.guild_id == interaction.guild.id)
+            async with Session.begin() as db:
+                db_manga = (
+                    await db.execute(
+                        sa.select(Manga).filter(Manga.mangadex_id == _manga.id, Manga.guild_id == interaction.guild.id)
+                    )
                 ).scalar_one_or_none()
 
                 if db_manga is not None:
@@ -100,10 +161,11 @@ class MangaDexCog(
         if interaction.guild is None or interaction.channel is None:
             return await interaction.response.send_message("This command must be used in a server.")
 
-        with Session(expire_on_commit=False) as db:
-            mangas = db.query(Manga).filter(Manga.guild_id == interaction.guild.id).all()
+        async with Session() as db:
+            mangas = list((await db.scalars(sa.select(Manga).filter(Manga.guild_id == interaction.guild.id))).all())
 
-            view = MangaNotificationView(mangas, interaction.user.id)
+        followed = await determine_followers(mangas, interaction.user.id)
+        view = MangaNotificationView(mangas, interaction.user.id, followed)
 
         await interaction.response.send_message(
             f"Select the manga you want to get notifications for. Page {view.page}/{view.last_page}",
@@ -111,152 +173,320 @@ class MangaDexCog(
             view=view,
         )
 
-    async def post(self, manga: Manga | None, latest: Chapter):
-        if manga is None:
-            return
+    async def post(self, manga: Manga, chapters: list[Chapter]) -> asyncio.Future | None:
+        """
+        Queue up the post for a manga's new chapters, oldest first, as the one message where they fit.
 
+        Returns a future that's done once it's been sent.
+        """
         guild = self.bot.get_guild(manga.guild_id)
 
         if guild is None:
-            return
+            return None
 
-        channel = await get_channel(guild, manga.channel_id)
+        channel = await self.bot.channel_cache.get(guild, manga.channel_id)
 
         if channel is None:
-            return
+            return None
 
-        role = discord.utils.get(guild.roles, name="Manga Updates")
+        followers = [follower.user_id for follower in manga.followers]
 
-        if role is None:
-            role = await guild.create_role(name="Manga Updates")
+        if PER_SUBSCRIPTION:
+            role = await self._roles.ensure(guild, manga.role_id, f"{manga.title} Updates", followers)
 
-        for member in role.members:
-            assert self.bot.user is not None
+            if role.id != manga.role_id:
+                manga.role_id = role.id
 
-            if member.id == self.bot.user.id:
-                continue
+                async with Session.begin() as db:
+                    await db.execute(sa.update(Manga).where(Manga.id == manga.id).values(role_id=role.id))
+        else:
+            role = discord.utils.get(guild.roles, name="Manga Updates")
 
-            await member.remove_roles(role)
+            if role is None:
+                role = await guild.create_role(name="Manga Updates")
 
-        for follower in manga.followers:
-            member = guild.get_member(follower.user_id)
+        if len(chapters) == 1:
+            content = f"{role.mention} New chapter of {manga.title} is out!"
+        else:
+            content = f"{role.mention} {len(chapters)} new chapters of {manga.title} are out!"
 
-            if member is None:
-                continue
+        embeds = []
 
-            await member.add_roles(role)
+        for i, latest in enumerate(chapters):
+            title = latest.title or manga.title
 
-        content = f"{role.mention} New chapter of {manga.title} is out!"
+            title += " "
 
-        title = latest.title or manga.title
+            if latest.volume is not None:
+                title += f"[Volume {latest.volume}]"
 
-        title += " "
+            if latest.chapter is not None:
+                title += f"[Chapter {latest.chapter}]"
 
-        if latest.volume is not None:
-            title += f"[Volume {latest.volume}]"
+            embed = discord.Embed(
+                title=title,
+                # The description's only worth having the once, and embeds share a size limit
+                description=manga.description if i == 0 else None,
+                url=f"https://mangadex.org/chapter/{latest.id}",
+            )
 
-        if latest.chapter is not None:
-            title += f"[Chapter {latest.chapter}]"
+            embed.set_author(name=manga.title, url=f"https://mangadex.org/title/{manga.mangadex_id}")
 
-        embed = discord.Embed(
-            title=title,
-            description=manga.description,
-            url=f"https://mangadex.org/chapter/{latest.id}",
-        )
+            embeds.append(embed)
 
-        embed.set_author(name=manga.title, url=f"https://mangadex.org/title/{manga.mangadex_id}")
+        file = None
+        cover = (manga.mangadex_id, manga.cover) if manga.cover is not None else None
 
-        if manga.cover is not None:
-            url = f"https://uploads.mangadex.org/covers/{manga.mangadex_id}/{manga.cover}"
+        if cover is not None:
+            # Once it's been uploaded anywhere, just link to that rather than uploading it again
+            if (url := self._covers.url(cover)) is not None:
+                embeds[0].set_image(url=url)
+            elif (data := await self._covers.get(self.bot.session, cover)) is not None:
+                file = discord.File(io.BytesIO(data), filename=self._covers.filename)
 
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url) as res:
-                    if res.status == 200:
-                        data = await res.read()
-                        file = discord.File(io.BytesIO(data), filename="cover.png")
+                embeds[0].set_image(url=f"attachment://{self._covers.filename}")
 
-                        embed.set_image(url="attachment://cover.png")
+        # With a role per subscription, the role's already right, so this can just be queued
+        if PER_SUBSCRIPTION:
+            delivered = self.bot.outbox.send(channel, content, embeds=embeds, file=file)
+        else:
+            # Only the sync and the send itself hold the role, not the cover download, and its own task sees to that
+            delivered = self._roles.post(
+                role, followers, lambda: self.bot.outbox.send(channel, content, embeds=embeds, file=file)
+            )
 
-                        await channel.send(content, file=file, embed=embed)
-                    else:
-                        await channel.send(content, embed=embed)
+        if file is not None:
+            delivered.add_done_callback(lambda future: self.uploaded(cover, future))
 
-    @tasks.loop(seconds=60)
-    async def mangadex(self):
-        await self.bot.wait_until_ready()
+        return delivered
 
-        with Session.begin() as db:
-            # This is done this way to limit the amount of
-            #  API requests we make to Mangadex.
-            query = sa.select(
-                Manga.mangadex_id,
-                sa.func.array_agg(
-                    Manga.id,
-                ).label("ids"),
-            ).group_by(Manga.mangadex_id)
-
-            all_manga = db.execute(query).all()
-
-            errors = 0
-
-            for row in all_manga:
-                ids: list[int] = row.ids
-
-                # Get the latest chapter, just continuing to the next one if we error
-                try:
-                    latest = await latest_chapter(row.mangadex_id)
-                except Exception:
-                    # If we error 5 times in a row, just stop
-                    errors += 1
-                    if errors >= 5:
-                        logger.error("Error getting latest chapter", exc_info=True)
-                        break
-                    else:
-                        continue
+    def uploaded(self, cover: tuple[str, str], delivered: asyncio.Future):
+        if delivered.cancelled() or delivered.exception() is not None:
+            return
 
-                for id in ids:
-                    manga = db.get(Manga, id)
+        # The file goes with the first message, if the embeds had to be spread over a few
+        sent = delivered.result()
+        self._covers.uploaded(cover, sent[0] if isinstance(sent, list) else sent)
 
-                    # This should NEVER happen, but just for typing sake
-                    if manga is None:
-                        logger.error(f"Manga {id} not found in database - how the hell?")
-                        continue
+    @tasks.loop(seconds=60)
+    async def mangadex(self):
+        await self.bot.wait_until_ready()
 
-                    # This is to clear out any manga follows that are no longer valid
+        started = time.monotonic()
+
+        try:
+            # Snapshot everything we need up front, so the connection isn't held
+            #  while we're waiting on MangaDex or Discord below.
+            follows = await load_follows()
+            cursors = await load_cursors()
+
+            # Cursor updates, keyed by Manga.id, written back in one go at the end
+            updates: dict[int, Chapter] = {}
+            polled: dict[int, datetime] = {}
+            # Queued posts, checked on once every manga has been gone through
+            posts: list[tuple[int, Chapter, datetime, asyncio.Future]] = []
+
+            # Each manga is asked for what's been published since its own fetch cursor, which moves on
+            #  whenever its batch comes back, whatever happens to the posts. Manga that don't have one
+            #  yet just have their latest chapter looked up instead.
+            since: dict[str, datetime] = {}
+            fresh: list[str] = []
+            # Follows a post to failed are left behind that, and have another go from where they got to
+            #  in a request of their own, so they never hold the rest back
+            behind: dict[str, list[Manga]] = {}
+            grouped: list[tuple[str, list[Manga]]] = []
+
+            for mangadex_id, mangas in follows.items():
+                reachable = []
+
+                for manga in mangas:
+                    # Skip any manga follows that are no longer valid
                     #  IE guild deleted, bot left guild, channel deleted, etc.
+                    #  the pruner cleans them out once they've been gone a while.
                     #  first check the guild
                     guild = self.bot.get_guild(manga.guild_id)
 
                     if guild is None:
-                        logger.error(f"Guild not found for manga {manga.id}  - should remove in future")
+                        logger.debug(f"Guild not found for manga {manga.id}")
                         continue
 
-                    # Then the channel
-                    channel = await get_channel(guild, manga.channel_id)
+                    # Then the channel, missing ones are remembered so they don't cost a request every tick
+                    channel = await self.bot.channel_cache.get(guild, manga.channel_id)
 
                     if channel is None:
-                        logger.error(f"Channel not found for manga {manga.id} - should remove in future")
+                        logger.debug(f"Channel not found for manga {manga.id}")
                         continue
 
-                    # Now, if we couldn't find the manga for whatever reason (network issues)
-                    #  just ignore it. We're doing this here, so that we can still check over
-                    #  guilds/channels regardless of if we can get the manga or not.
-                    if latest is None:
-                        logger.error(f"Latest chapter not found for manga {manga.id} - most likely network issues")
+                    reachable.append(manga)
+
+                if not reachable:
+                    continue
+
+                # Follows polled before fetch cursors were kept per manga are as far along as the furthest of them
+                cursor = cursors.get(mangadex_id) or max(
+                    (manga.polled_at for manga in reachable if manga.polled_at is not None), default=None
+                )
+
+                if cursor is None:
+                    fresh.append(mangadex_id)
+                else:
+                    since[mangadex_id] = cursor
+
+                current = []
+
+                for manga in reachable:
+                    if cursor is not None and manga.polled_at is not None and manga.polled_at < cursor:
+                        behind.setdefault(mangadex_id, []).append(manga)
+                    else:
+                        current.append(manga)
+
+                grouped.append((mangadex_id, current))
+
+            # Sorted by cursor, so each batch asks for as little history as it can
+            known = sorted(since, key=since.__getitem__)
+            batches = [(fresh[i : i + BATCH_SIZE], None) for i in range(0, len(fresh), BATCH_SIZE)]
+            batches += [
+                (known[i : i + BATCH_SIZE], since[known[i]]) for i in range(0, len(known), BATCH_SIZE)
+            ]
+
+            # From what the furthest behind of them last posted, or got to if that's nothing yet
+            retries = [
+                ([mangadex_id], min(manga.latest_published_at or manga.polled_at for manga in mangas))
+                for mangadex_id, mangas in behind.items()
+            ]
+
+            # The new chapters of every followed manga, newest first, a batch of manga per request
+            result, retried = await asyncio.gather(
+                self._fetcher.fetch(self.bot.session, batches),
+                self._fetcher.fetch(self.bot.session, retries),
+            )
+
+            logger.debug(
+                f"Fetched new chapters for {len(grouped)} manga in {len(batches)} batches, "
+                f"and retried {len(retries)}, in {max(result.duration, retried.duration):.3f}s"
+            )
+
+            # What each lot of follows is posted from, and how far along that takes them
+            work = [
+                (mangas, result.chapters.get(mangadex_id, []), result.covered.get(mangadex_id))
+                for mangadex_id, mangas in grouped
+            ]
+
+            for mangadex_id, mangas in behind.items():
+                chapters = retried.chapters.get(mangadex_id, [])
+                covered = retried.covered.get(mangadex_id)
+
+                # Caught up to where the rest were fetched from, so they rejoin them, with what they got too
+                if covered is not None and covered >= since[mangadex_id] - OVERLAP and mangadex_id in result.covered:
+                    seen = {chapter.id for chapter in chapters}
+                    chapters += [chapter for chapter in result.chapters.get(mangadex_id, []) if chapter.id not in seen]
+                    chapters.sort(key=lambda chapter: chapter.published, reverse=True)
+                    covered = result.covered[mangadex_id]
+
+                work.append((mangas, chapters, covered))
+
+            # Whatever batches did come back still get posted
+            for mangas, chapters, covered in work:
+                # Its batch failed, so it's tried again from the same place next tick
+                if covered is None:
+                    continue
+
+                for manga in mangas:
+                    # Nothing new's been published, so just move its cursor along
+                    if not chapters:
+                        polled[manga.id] = covered
                         continue
 
-                    # Also ignore if the latest chapter is the same as the one we have stored
-                    if latest.id == manga.latest_chapter_id:
+                    cursor = manga.latest_published_at
+
+                    if cursor is None:
+                        # No cursor yet, so only the latest chapter is new, and only if it's not the one we have
+                        new = chapters[:1] if chapters[0].id != manga.latest_chapter_id else []
+
+                        # Either way, this is where its cursor starts from
+                        if not new:
+                            updates[manga.id] = chapters[0]
+                    else:
+                        new = [chapter for chapter in chapters if chapter.published > cursor]
+
+                    if not new:
+                        polled[manga.id] = covered
                         continue
 
-                    # Otherwise it's a new one, so post it
+                    # Otherwise post them, oldest first
                     try:
-                        await self.post(manga, latest)
+                        delivered = await self.post(manga, new[::-1])
                     except Exception as e:
-                        logger.error("Error posting new chapter", exc_info=e)
-                    else:
-                        manga.latest_chapter_id = latest.id
-
+                        logger.error("Error posting new chapters", exc_info=e)
+                        continue
 
-async def setup(bot: commands.Bot):
+                    if delivered is not None:
+                        posts.append((manga.id, new[0], covered, delivered))
+
+            # Only what was actually sent moves a follow on, anything else gets another go
+            await asyncio.gather(*(delivered for *_, delivered in posts), return_exceptions=True)
+
+            posted = 0
+
+            for id, latest, covered, delivered in posts:
+                if not delivered.cancelled() and delivered.exception() is None:
+                    updates[id] = latest
+                    polled[id] = covered
+                    posted += 1
+
+            if result.failed or retried.failed:
+                retry_after = max((after for after in (result.retry_after, retried.retry_after) if after), default=None)
+                self._schedule.failed(SOURCE, retry_after)
+            else:
+                self._schedule.record(SOURCE, new=posted)
+
+            # Cursors of manga nobody follows any more, so following one again doesn't start from back then
+            stale = [cursor_source(mangadex_id) for mangadex_id in cursors.keys() - follows.keys()]
+
+            if updates or polled or result.covered or stale:
+                async with Session.begin() as db:
+                    if result.covered:
+                        values = insert(PollCursor).values(
+                            [
+                                {"source": cursor_source(mangadex_id), "cursor": covered.isoformat()}
+                                for mangadex_id, covered in result.covered.items()
+                            ]
+                        )
+                        await db.execute(
+                            values.on_conflict_do_update(
+                                index_elements=[PollCursor.source], set_={"cursor": values.excluded.cursor}
+                            )
+                        )
+
+                    if stale:
+                        await db.execute(sa.delete(PollCursor).where(PollCursor.source.in_(stale)))
+
+                    if updates:
+                        await db.execute(
+                            sa.update(Manga),
+                            [
+                                {"id": id, "latest_chapter_id": latest.id, "latest_published_at": latest.published}
+                                for id, latest in updates.items()
+                            ],
+                        )
+
+                    if polled:
+                        await db.execute(
+                            sa.update(Manga),
+                            [{"id": id, "polled_at": covered} for id, covered in polled.items()],
+                        )
+        finally:
+            # Never spin, even if something blew up before the schedule heard about this tick
+            delay = max(self._schedule.delay(SOURCE), 1)
+            self.mangadex.change_interval(seconds=delay)
+
+            duration = time.monotonic() - started
+
+            if duration > delay:
+                logger.warning(f"MangaDex tick took {duration:.3f}s, longer than the {delay:.0f}s until the next")
+            else:
+                logger.debug(f"MangaDex tick took {duration:.3f}s")
+
+
+async def setup(bot: Himari):
     await bot.add_cog(MangaDexCog(bot))
@@ -1,33 +1,41 @@
+import asyncio
 import logging
-from typing import Union, cast
+from typing import Union
 
 import aiohttp
 import discord
-import feedparser
 import sqlalchemy as sa
 from discord.ext import commands, tasks
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
 
 from src import Session
-from src.models.database import Nyaa
-from src.utils import get_channel, search
-from src.utils.nyaa import magnet
-from src.views.nyaa import NyaaNotificationView
+from src.bot import Himari
+from src.models.database import Nyaa, NyaaSeen
+from src.utils.feeds import FeedEntry
+from src.utils.http import ConditionalGet, TokenBucket, retry_after
+from src.utils.nyaa import SEEN_LIMIT, Matcher, Planner, SeenSet, magnet, merge_entries
+from src.utils.roles import PER_SUBSCRIPTION, RoleSync
+from src.utils.scheduler import AdaptiveSchedule, PollConfig
+from src.views.nyaa import NyaaNotificationView, determine_followers
 
 URL = "https://nyaa.si/?page=rss"
+POLL = PollConfig.from_env("NYAA", minimum=5, maximum=60)
 
 
 logger = logging.getLogger(__name__)
 
 
-async def generate_embed(entry: feedparser.FeedParserDict, given_title: str) -> discord.Embed:
+async def generate_embed(entry: FeedEntry, given_title: str) -> discord.Embed:
     """
     Generates a discord embed for a nyaa torrent.
     """
     title = entry.title
-    hash = entry.nyaa_infohash
+    hash = entry.infohash
     url = entry.id
-    category = entry.nyaa_category
-    size = entry.nyaa_size
+    category = entry.category
+    size = entry.size
     torrent_link = entry.link
     magnet_link = await magnet(str(title), str(hash))
 
@@ -48,13 +56,13 @@ Magnet Link (Copy paste):
     return embed
 
 
-def get_latest(feed, name: str, latest: str | None = None) -> list[feedparser.FeedParserDict]:
+def get_latest(entries: list[FeedEntry], latest: str | None = None) -> list[FeedEntry]:
+    """
+    Get the entries newer than `latest`, out of the (newest first) entries matching a subscription.
+    """
     results = []
 
-    for entry in feed.entries:
-        if not search(entry.title, name):
-            continue
-
+    for entry in entries:
         # This one's a bit special, only give us the latest one, and then stop.
         if latest is None:
             results.append(entry)
@@ -68,14 +76,40 @@ def get_latest(feed, name: str, latest: str | None = None) -> list[feedparser.Fe
     return results
 
 
+async def prune_seen(db: AsyncSession, ids: set[int]):
+    """
+    Trim the seen set for these subscriptions down to the newest SEEN_LIMIT rows each.
+    """
+    ranked = (
+        sa.select(
+            NyaaSeen.id,
+            sa.func.row_number().over(partition_by=NyaaSeen.nyaa_id, order_by=NyaaSeen.id.desc()).label("rank"),
+        )
+        .where(NyaaSeen.nyaa_id.in_(ids))
+        .subquery()
+    )
+
+    await db.execute(
+        sa.delete(NyaaSeen).where(NyaaSeen.id.in_(sa.select(ranked.c.id).where(ranked.c.rank > SEEN_LIMIT)))
+    )
+
+
 @discord.app_commands.guild_only()
 class NyaaCog(
     commands.GroupCog,
     name="nyaa",
     description="Commands to manage Nyaa.si RSS feed stuff.",
 ):
-    def __init__(self, bot: commands.Bot):
+    def __init__(self, bot: Himari):
         self.bot = bot
+        self._rss = ConditionalGet()
+        self._matcher = Matcher()
+        self._seen = SeenSet()
+        self._seen_loaded = False
+        # nyaa.si asks for searches to be kept to about one a second
+        self._planner = Planner(TokenBucket(rate=1, capacity=3))
+        self._schedule = AdaptiveSchedule(POLL)
+        self._roles = RoleSync()
 
     async def cog_load(self) -> None:
         self.nyaa.start()
@@ -103,9 +137,9 @@ class NyaaCog(
             await interaction.response.send_message("This command must be used in a server.", ephemeral=True)
             return
 
-        with Session.begin() as session:
-            nyaa = session.execute(
-                sa.select(Nyaa).filter(Nyaa.name == name, Nyaa.guild_id == interaction.guild.id)
+        async with Session.begin() as session:
+            nyaa = (
+                await session.execute(sa.select(Nyaa).filter(Nyaa.name == name, Nyaa.guild_id == interaction.guild.id))
             ).scalar_one_or_none()
 
             if nyaa:
@@ -114,8 +148,10 @@ class NyaaCog(
                 )
                 return
 
-            nyaa = session.execute(
-                sa.select(Nyaa).filter(Nyaa.match == match, Nyaa.guild_id == interaction.guild.id)
+            nyaa = (
+                await session.execute(
+                    sa.select(Nyaa).filter(Nyaa.match == match, Nyaa.guild_id == interaction.guild.id)
+                )
             ).scalar_one_or_none()
 
             if nyaa:
@@ -134,6 +170,8 @@ class NyaaCog(
             )
             session.add(rss)
 
+        self._matcher.add(rss.id, rss.match)
+
         await interaction.response.send_message(f"Added Nyaa feed `{name}`")
 
     @discord.app_commands.command(description="Remove an RSS feed from the database")
@@ -148,9 +186,13 @@ class NyaaCog(
             await interaction.response.send_message("This command must be used in a server.", ephemeral=True)
             return
 
-        with Session.begin() as session:
-            rss = session.execute(
-                sa.select(Nyaa).filter(Nyaa.name == name, Nyaa.guild_id == interaction.guild.id)
+        async with Session.begin() as session:
+            rss = (
+                await session.execute(
+                    sa.select(Nyaa)
+                    .filter(Nyaa.name == name, Nyaa.guild_id == interaction.guild.id)
+                    .options(selectinload(Nyaa.followers))
+                )
             ).scalar_one_or_none()
 
             if not rss:
@@ -162,8 +204,14 @@ class NyaaCog(
                 return
 
             for follower in rss.followers:
-                session.delete(follower)
-            session.delete(rss)
+                await session.delete(follower)
+            await session.delete(rss)
+
+        self._matcher.remove(rss.id)
+
+        # Its own notification role goes with it
+        if rss.role_id is not None and (role := interaction.guild.get_role(rss.role_id)) is not None:
+            await role.delete()
 
         await interaction.response.send_message(f"Removed RSS feed `{name}`")
 
@@ -174,8 +222,8 @@ class NyaaCog(
             await interaction.response.send_message("This command must be used in a server.", ephemeral=True)
             return
 
-        with Session.begin() as session:
-            feeds = session.execute(sa.select(Nyaa).filter(Nyaa.guild_id == interaction.guild.id)).scalars().all()
+        async with Session.begin() as session:
+            feeds = (await session.scalars(sa.select(Nyaa).filter(Nyaa.guild_id == interaction.guild.id))).all()
 
             if not feeds:
                 await interaction.response.send_message("No RSS feeds found")
@@ -191,10 +239,11 @@ class NyaaCog(
             await interaction.response.send_message("This command must be used in a server.")
             return
 
-        with Session(expire_on_commit=False) as db:
-            mangas = db.query(Nyaa).filter(Nyaa.guild_id == interaction.guild.id).all()
+        async with Session() as db:
+            seeds = list((await db.scalars(sa.select(Nyaa).filter(Nyaa.guild_id == interaction.guild.id))).all())
 
-            view = NyaaNotificationView(mangas, interaction.user.id)
+        followed = await determine_followers(seeds, interaction.user.id)
+        view = NyaaNotificationView(seeds, interaction.user.id, followed)
 
         await interaction.response.send_message(
             f"Select the seeds you want to get notifications for. Page {view.page}/{view.last_page}",
@@ -202,70 +251,173 @@ class NyaaCog(
             view=view,
         )
 
-    async def post(self, nyaa: Nyaa, channel: discord.TextChannel | discord.Thread, entry: feedparser.FeedParserDict):
+    async def post(
+        self, nyaa: Nyaa, channel: discord.TextChannel | discord.Thread, entry: FeedEntry
+    ) -> asyncio.Future[None]:
+        """
+        Queue up the post for an entry, returning a future that's done once it's been sent.
+        """
         embed = await generate_embed(entry, nyaa.name)
-        role = discord.utils.get(channel.guild.roles, name="Nyaa Seed Updates")
+        followers = [follower.user_id for follower in nyaa.followers]
 
-        if role is None:
-            role = await channel.guild.create_role(name="Nyaa Seed Updates")
+        # With a role per subscription, the role's already right, so this can just be queued
+        if PER_SUBSCRIPTION:
+            role = await self._roles.ensure(channel.guild, nyaa.role_id, f"{nyaa.name.title()} Seed Updates", followers)
 
-        for member in role.members:
-            assert self.bot.user is not None
+            if role.id != nyaa.role_id:
+                nyaa.role_id = role.id
 
-            if member.id == self.bot.user.id:
-                continue
+                async with Session.begin() as db:
+                    await db.execute(sa.update(Nyaa).where(Nyaa.id == nyaa.id).values(role_id=role.id))
 
-            await member.remove_roles(role)
+            content = f"{role.mention} New seed has been posted for {nyaa.name}"
+            return self.bot.outbox.send(channel, content, embed=embed)
 
-        for follower in nyaa.followers:
-            member = channel.guild.get_member(follower.user_id)
-
-            if member is None:
-                continue
+        role = discord.utils.get(channel.guild.roles, name="Nyaa Seed Updates")
 
-            await member.add_roles(role)
+        if role is None:
+            role = await channel.guild.create_role(name="Nyaa Seed Updates")
 
-        await channel.send(f"{role.mention} New seed has been posted for {nyaa.name}", embed=embed)
+        # The shared role has to stay put until the mention's actually gone out, which its own task sees to
+        content = f"{role.mention} New seed has been posted for {nyaa.name}"
+        return self._roles.post(role, followers, lambda: self.bot.outbox.send(channel, content, embed=embed))
 
     @tasks.loop(seconds=5)
     async def nyaa(self):
         await self.bot.wait_until_ready()
 
         try:
-            with Session.begin() as db:
-                feeds = db.execute(sa.select(Nyaa)).scalars().all()
+            # Get the RSS feed data, skipping everything if it hasn't changed since last tick
+            try:
+                body = await self._rss.fetch(self.bot.session, URL)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                headers = e.headers if isinstance(e, aiohttp.ClientResponseError) else None
+                self._schedule.failed(URL, retry_after(headers))
+                logger.warning(f"Error fetching Nyaa feed: {e!r}")
+                return
+
+            if body is None:
+                self._schedule.record(URL, new=0)
+                return
+
+            # Parsed off in the worker pool, so the event loop isn't stuck on it
+            page = await self.bot.feeds.parse(body)
+            new, overflowed = self._planner.observe(page)
+            entries = page
+
+            self._schedule.record(URL, new=new)
+
+            # Snapshot the subscriptions and let the connection go straight back to the pool,
+            #  none of the network calls below should be holding a transaction open.
+            async with Session() as db:
+                feeds = (await db.scalars(sa.select(Nyaa).options(selectinload(Nyaa.followers)))).all()
+
+                # The seen set is only read from the database once, after that memory is kept in step with it
+                if not self._seen_loaded:
+                    rows = await db.execute(sa.select(NyaaSeen.nyaa_id, NyaaSeen.infohash).order_by(NyaaSeen.id))
+
+                    for row in rows:
+                        self._seen.add(row.nyaa_id, row.infohash)
 
-                async with aiohttp.ClientSession() as session:
-                    # Get the RSS feed data
-                    async with session.get(URL) as resp:
-                        if resp.status > 299:
-                            return
+                    self._seen_loaded = True
 
-                        # Pass to feedparser
-                        data = feedparser.parse(await resp.text())
+            # More was published since last tick than fits on one page, so go and find what fell off it
+            if overflowed and feeds:
+                logger.warning("Nyaa feed moved on by more than a page since last tick, backfilling")
+                wanted = (feed.match for feed in feeds)
+                backfilled = await self._planner.backfill(self.bot.session, self.bot.feeds, wanted)
+                entries = merge_entries(entries, backfilled)
 
+            # Picks up anything changed outside of follow/unfollow, only recompiling what differs
+            self._matcher.sync((feed.id, feed.match) for feed in feeds)
+            self._seen.retain(feed.id for feed in feeds)
+            # Each entry title is only looked at once here, rather than once per subscription
+            matches = self._matcher.route(entries, lambda entry: entry.title)
+
+            # Cursor updates, keyed by Nyaa.id, written back in one go at the end
+            updates: dict[int, str] = {}
+            # New nyaa_seen rows, likewise
+            seen: list[dict] = []
+
+            # Queued posts, checked on once everything's been handed to the outbox
+            posts: list[tuple[int, FeedEntry, asyncio.Future[None]]] = []
+
+            def mark(id: int, entry: FeedEntry):
+                infohash = str(entry.infohash)
+
+                self._seen.add(id, infohash)
+                seen.append({"nyaa_id": id, "infohash": infohash})
+
+            try:
                 # Go through each RSS feed
                 for nyaa_match in feeds:
+                    matched = matches.get(nyaa_match.id, [])
+
+                    if self._seen.known(nyaa_match.id):
+                        entries = [e for e in matched if not self._seen.has(nyaa_match.id, str(e.infohash))]
+                    else:
+                        # No history for this one yet (just followed, or from before the seen set existed),
+                        #  so fall back on the cursor this once and count the rest of the page as handled.
+                        entries = get_latest(matched, nyaa_match.latest)
+
+                        for entry in matched:
+                            if entry not in entries:
+                                mark(nyaa_match.id, entry)
+
+                    # Nothing new for this one, so no need to go looking for its channel
+                    if not entries:
+                        self._seen.touch(nyaa_match.id)
+                        continue
+
                     # Make sure the channel exists we want to send to
                     guild = self.bot.get_guild(nyaa_match.guild_id)
                     if guild is None:
                         continue
 
-                    channel = await get_channel(guild, nyaa_match.channel_id)
+                    channel = await self.bot.channel_cache.get(guild, nyaa_match.channel_id)
 
                     if channel is None:
                         continue
 
-                    entry = None
+                    # One subscription going wrong doesn't stop the rest, what didn't go out gets another go
+                    try:
+                        for entry in reversed(entries):
+                            posts.append((nyaa_match.id, entry, await self.post(nyaa_match, channel, entry)))
+                    except Exception as e:
+                        logger.error(f"Error posting new seeds for {nyaa_match.id}", exc_info=e)
+            finally:
+                # Only what was actually sent is remembered, so anything that failed gets another go
+                await asyncio.gather(*(delivered for *_, delivered in posts), return_exceptions=True)
+
+                for id, entry, delivered in posts:
+                    if delivered.cancelled() or delivered.exception() is not None:
+                        continue
+
+                    mark(id, entry)
+                    updates[id] = entry.id
+
+                if updates or seen:
+                    async with Session.begin() as db:
+                        if updates:
+                            await db.execute(
+                                sa.update(Nyaa),
+                                [{"id": id, "latest": latest} for id, latest in updates.items()],
+                            )
 
-                    for entry in reversed(get_latest(data, nyaa_match.match, nyaa_match.latest)):
-                        await self.post(nyaa_match, channel, entry)
+                        if seen:
+                            await db.execute(insert(NyaaSeen).on_conflict_do_nothing(), seen)
+                            await prune_seen(db, {row["nyaa_id"] for row in seen})
 
-                    if entry is not None:
-                        nyaa_match.latest = cast(str, entry.id)
+            # Only now is the next page compared against this one, a failed tick leaves the last good page
+            self._planner.handled(page)
         except Exception as e:
+            # Make sure this same feed gets another go next tick, rather than being skipped as unchanged
+            self._rss.forget(URL)
             logger.error("Error in nyaa loop", exc_info=e)
+        finally:
+            # Never spin, even if something blew up before the schedule heard about this tick
+            self.nyaa.change_interval(seconds=max(self._schedule.delay(URL), 1))
 
 
-async def setup(bot: commands.Bot) -> None:
+async def setup(bot: Himari) -> None:
     await bot.add_cog(NyaaCog(bot))
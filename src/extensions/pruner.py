@@ -0,0 +1,143 @@
+import logging
+import os
+
+import discord
+import sqlalchemy as sa
+from discord.ext import commands, tasks
+
+from src import Session
+from src.bot import Himari
+from src.models.database import JNovel, Manga, MangaFollower, Nyaa, NyaaFollower
+
+logger = logging.getLogger(__name__)
+
+# How many checks in a row a subscription's guild or channel has to be missing for, before it's removed
+PRUNE_AFTER = int(os.getenv("PRUNE_AFTER", 3))
+
+Subscription = type[Manga] | type[Nyaa] | type[JNovel]
+
+
+class Pruner(commands.Cog):
+    """
+    Removes subscriptions whose guild or channel has been gone for a while.
+    """
+
+    def __init__(self, bot: Himari):
+        self.bot = bot
+        # Consecutive misses, keyed by table and row id
+        self._misses: dict[tuple[str, int], int] = {}
+
+    async def cog_load(self) -> None:
+        self.prune.start()
+
+    async def cog_unload(self) -> None:
+        self.prune.cancel()
+
+    async def gone(self, guild_id: int, channel_id: int) -> bool | None:
+        """
+        Whether a subscription's guild or channel is gone, None if we can't tell right now.
+        """
+        guild = self.bot.get_guild(guild_id)
+
+        if guild is None:
+            return True
+
+        # An outage on Discord's side, not something that's been deleted
+        if guild.unavailable:
+            return None
+
+        try:
+            return await self.bot.channel_cache.get(guild, channel_id) is None
+        except discord.HTTPException:
+            return None
+
+    async def check(self, model: Subscription) -> list[int]:
+        """
+        Count up the misses for every row of a table, returning the ids that have had enough of them.
+        """
+        async with Session() as db:
+            rows = (await db.execute(sa.select(model.id, model.guild_id, model.channel_id))).all()
+
+        table = model.__tablename__
+        expired = []
+
+        for row in rows:
+            key = (table, row.id)
+            gone = await self.gone(row.guild_id, row.channel_id)
+
+            if gone is None:
+                continue
+
+            if not gone:
+                self._misses.pop(key, None)
+                continue
+
+            self._misses[key] = self._misses.get(key, 0) + 1
+
+            if self._misses[key] >= PRUNE_AFTER:
+                expired.append(row.id)
+
+        # Rows deleted in the meantime don't need counting any more
+        ids = {row.id for row in rows}
+        for key in [key for key in self._misses if key[0] == table and key[1] not in ids]:
+            del self._misses[key]
+
+        return expired
+
+    async def delete_roles(self, model: type[Manga] | type[Nyaa], ids: list[int]):
+        """
+        Subscriptions with their own role take it with them, if the guild is still around to have it.
+        """
+        async with Session() as db:
+            rows = await db.execute(
+                sa.select(model.guild_id, model.role_id).where(model.id.in_(ids), model.role_id.is_not(None))
+            )
+
+        for row in rows:
+            guild = self.bot.get_guild(row.guild_id)
+            role = guild.get_role(row.role_id) if guild is not None else None
+
+            if role is None:
+                continue
+
+            try:
+                await role.delete()
+            except discord.HTTPException as e:
+                logger.warning(f"Couldn't delete role {role.id} of a pruned subscription: {e!r}")
+
+    @tasks.loop(hours=1)
+    async def prune(self):
+        await self.bot.wait_until_ready()
+
+        try:
+            manga = await self.check(Manga)
+            nyaa = await self.check(Nyaa)
+            j_novel = await self.check(JNovel)
+
+            if not (manga or nyaa or j_novel):
+                return
+
+            logger.info(f"Pruning {len(manga)} manga, {len(nyaa)} nyaa and {len(j_novel)} j-novel subscriptions")
+
+            if manga:
+                await self.delete_roles(Manga, manga)
+            if nyaa:
+                await self.delete_roles(Nyaa, nyaa)
+
+            async with Session.begin() as db:
+                # Followers first, their foreign keys don't cascade
+                await db.execute(sa.delete(MangaFollower).where(MangaFollower.manga_id.in_(manga)))
+                await db.execute(sa.delete(Manga).where(Manga.id.in_(manga)))
+                await db.execute(sa.delete(NyaaFollower).where(NyaaFollower.nyaa_id.in_(nyaa)))
+                await db.execute(sa.delete(Nyaa).where(Nyaa.id.in_(nyaa)))
+                await db.execute(sa.delete(JNovel).where(JNovel.id.in_(j_novel)))
+
+            for table, ids in (("manga", manga), ("nyaa", nyaa), ("j_novel", j_novel)):
+                for id in ids:
+                    self._misses.pop((table, id), None)
+        except Exception as e:
+            logger.error("Error in pruner loop", exc_info=e)
+
+
+async def setup(bot: Himari):
+    await bot.add_cog(Pruner(bot))
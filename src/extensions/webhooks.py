@@ -0,0 +1,58 @@
+import discord
+from discord.ext import commands
+
+from src.bot import Himari
+
+
+@discord.app_commands.guild_only()
+class WebhookCog(
+    commands.GroupCog,
+    name="webhook",
+    description="Commands to manage posting feeds through a webhook.",
+):
+    def __init__(self, bot: Himari):
+        self.bot = bot
+
+    @discord.app_commands.command(description="Post feed updates in a channel through a webhook.")
+    @discord.app_commands.describe(channel="The channel to post feed updates through a webhook in.")
+    async def enable(self, interaction: discord.Interaction, channel: discord.TextChannel):
+        """
+        Post feed updates in a channel through a webhook, for channels following a lot of feeds.
+        """
+        if interaction.guild is None or not isinstance(interaction.user, discord.Member):
+            return await interaction.response.send_message("This command must be used in a server.", ephemeral=True)
+
+        if not interaction.user.guild_permissions.manage_guild:
+            return await interaction.response.send_message(
+                "You need the Manage Server permission to do that.", ephemeral=True
+            )
+
+        await self.bot.webhooks.enable(interaction.guild.id, channel.id)
+
+        await interaction.response.send_message(
+            f"Feed updates in {channel.mention} (and its threads) will be posted through a webhook.", ephemeral=True
+        )
+
+    @discord.app_commands.command(description="Go back to posting feed updates in a channel as the bot.")
+    @discord.app_commands.describe(channel="The channel to stop using a webhook in.")
+    async def disable(self, interaction: discord.Interaction, channel: discord.TextChannel):
+        """
+        Go back to posting feed updates in a channel as the bot, deleting its webhook.
+        """
+        if interaction.guild is None or not isinstance(interaction.user, discord.Member):
+            return await interaction.response.send_message("This command must be used in a server.", ephemeral=True)
+
+        if not interaction.user.guild_permissions.manage_guild:
+            return await interaction.response.send_message(
+                "You need the Manage Server permission to do that.", ephemeral=True
+            )
+
+        await self.bot.webhooks.disable(channel.id)
+
+        await interaction.response.send_message(
+            f"Feed updates in {channel.mention} will be posted as the bot again.", ephemeral=True
+        )
+
+
+async def setup(bot: Himari):
+    await bot.add_cog(WebhookCog(bot))
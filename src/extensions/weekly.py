@@ -1,20 +1,29 @@
 import random
 import string
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
 
 import discord
-import pytz
 import sqlalchemy as sa
-from discord.ext import commands
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
 
-from src import Session
-from src.models.database import Failure, Success, Weekly
+from src import Session, bot
+from src.bot import Himari
+from src.models.database import Failure, Job, Success, Weekly
+
+TIMEZONE = ZoneInfo("America/New_York")
+
+# The job that keeps `Weekly.next_occurrence` rolling forward
+KIND = "weekly"
+KEY = "weekly:roll"
+
+LIST_PAGE_SIZE = 25
 
 
 def get_next_timestamp(timestamp: int) -> tuple[int, bool]:
-    tz = pytz.timezone("America/New_York")
-    dt = datetime.fromtimestamp(timestamp, tz=tz)
-    today = datetime.now(tz=tz).replace(hour=dt.hour, minute=dt.minute, second=0)
+    dt = datetime.fromtimestamp(timestamp, tz=TIMEZONE)
+    today = datetime.now(tz=TIMEZONE).replace(hour=dt.hour, minute=dt.minute, second=0)
 
     # The only case that we DON'T want to find the next timestamp that matches the
     #  day of the week is if it's on the same day, within 3 hours after the time
@@ -37,6 +46,75 @@ def get_next_timestamp(timestamp: int) -> tuple[int, bool]:
     return int(next_dt.timestamp()), today.weekday() == dt.weekday()
 
 
+def rolls_over(occurrence: int) -> int:
+    """
+    When `get_next_timestamp` moves on from this occurrence, midnight at the end of its day.
+    """
+    dt = datetime.fromtimestamp(occurrence, tz=TIMEZONE) + timedelta(days=1)
+    return int(dt.replace(hour=0, minute=0, second=0).timestamp())
+
+
+def next_occurrence(countdown: Weekly) -> tuple[int, bool]:
+    """
+    `get_next_timestamp`, from the stored occurrence unless it's due to be rolled forward.
+    """
+    occurrence = countdown.next_occurrence
+
+    if occurrence is None or rolls_over(occurrence) <= datetime.now().timestamp():
+        return get_next_timestamp(countdown.timestamp)
+
+    today = datetime.now(tz=TIMEZONE).date()
+    return occurrence, datetime.fromtimestamp(occurrence, tz=TIMEZONE).date() == today
+
+
+async def roll(session: AsyncSession, *where: sa.ColumnElement[bool]):
+    """
+    Move the weeklies (matching `where`) that have come round on to their next occurrence.
+    """
+    now = int(datetime.now().timestamp())
+
+    # Occurrences only roll over after they've started, so the rest needn't be looked at
+    countdowns = (
+        await session.scalars(
+            sa.select(Weekly).where(
+                sa.or_(
+                    Weekly.next_occurrence.is_(None),
+                    Weekly.next_occurrence <= now,
+                ),
+                *where,
+            )
+        )
+    ).all()
+
+    for countdown in countdowns:
+        if countdown.next_occurrence is None or rolls_over(countdown.next_occurrence) <= now:
+            countdown.next_occurrence = get_next_timestamp(countdown.timestamp)[0]
+
+    await session.flush()
+
+
+async def roll_forward(job: Job) -> datetime | None:
+    """
+    Roll every weekly forward, then wait for the next one to come round.
+    """
+    async with Session.begin() as session:
+        await roll(session)
+
+        earliest = await session.scalar(sa.select(sa.func.min(Weekly.next_occurrence)))
+
+    if earliest is None:
+        return None
+
+    return datetime.fromtimestamp(rolls_over(earliest), tz=timezone.utc)
+
+
+async def reschedule():
+    """
+    Have the roll forward job look again now, after a weekly's been added.
+    """
+    await bot.jobs.schedule(KIND, KEY, datetime.now(tz=timezone.utc))
+
+
 weekly = discord.app_commands.Group(
     name="weekly", guild_only=True, description="Handles weekly countdowns."
 )
@@ -57,17 +135,15 @@ async def create(interaction: discord.Interaction, lookup: str, timestamp: int)
         return
 
     # First make sure there's not a countdown with the same lookup
-    with Session.begin() as session:
+    async with Session.begin() as session:
         countdowns = (
-            session.execute(
+            await session.scalars(
                 sa.select(Weekly).filter(
                     Weekly.guild_id == interaction.guild.id,
                     Weekly.lookup == lookup,
                 )
             )
-            .scalars()
-            .all()
-        )
+        ).all()
 
         if len(countdowns) > 0:
             await interaction.response.send_message(
@@ -80,6 +156,7 @@ async def create(interaction: discord.Interaction, lookup: str, timestamp: int)
             lookup=lookup,
             timestamp=timestamp,
             user_id=interaction.user.id,
+            next_occurrence=get_next_timestamp(timestamp)[0],
         )
         session.add(countdown)
 
@@ -87,6 +164,8 @@ async def create(interaction: discord.Interaction, lookup: str, timestamp: int)
         f"Weekly created. Lookup: `{lookup}`, Timestamp: <t:{timestamp}>"
     )
 
+    await reschedule()
+
 
 @weekly.command(description="Delete a weekly countdown.")
 @discord.app_commands.describe(
@@ -105,11 +184,13 @@ async def delete(interaction: discord.Interaction, lookup: str) -> None:
         )
         return
 
-    with Session.begin() as session:
-        countdown = session.execute(
-            sa.select(Weekly).filter(
-                Weekly.guild_id == interaction.guild.id,
-                Weekly.lookup == lookup,
+    async with Session.begin() as session:
+        countdown = (
+            await session.execute(
+                sa.select(Weekly).filter(
+                    Weekly.guild_id == interaction.guild.id,
+                    Weekly.lookup == lookup,
+                )
             )
         ).scalar_one_or_none()
 
@@ -128,7 +209,7 @@ async def delete(interaction: discord.Interaction, lookup: str) -> None:
             )
             return
 
-        session.delete(countdown)
+        await session.delete(countdown)
 
     await interaction.response.send_message(f"Weekly countdown {lookup} deleted.")
 
@@ -146,11 +227,18 @@ async def lookup(interaction: discord.Interaction, lookup: str) -> None:
         )
         return
 
-    with Session.begin() as session:
-        countdown = session.execute(
-            sa.select(Weekly).filter(
-                Weekly.guild_id == interaction.guild.id,
-                Weekly.lookup == lookup,
+    async with Session.begin() as session:
+        countdown = (
+            await session.execute(
+                sa.select(Weekly)
+                .filter(
+                    Weekly.guild_id == interaction.guild.id,
+                    Weekly.lookup == lookup,
+                )
+                .options(
+                    selectinload(Weekly.success_gifs),
+                    selectinload(Weekly.failure_gifs),
+                )
             )
         ).scalar_one_or_none()
 
@@ -160,7 +248,7 @@ async def lookup(interaction: discord.Interaction, lookup: str) -> None:
             )
             return
 
-        timestamp, on_day = get_next_timestamp(countdown.timestamp)
+        timestamp, on_day = next_occurrence(countdown)
 
         embed = discord.Embed(
             title=f"Weekly to {lookup.title()}",
@@ -205,11 +293,15 @@ async def addsuccess(interaction: discord.Interaction, lookup: str, url: str) ->
         )
         return
 
-    with Session.begin() as session:
-        countdown = session.execute(
-            sa.select(Weekly).filter(
-                Weekly.guild_id == interaction.guild.id,
-                Weekly.lookup == lookup,
+    async with Session.begin() as session:
+        countdown = (
+            await session.execute(
+                sa.select(Weekly)
+                .filter(
+                    Weekly.guild_id == interaction.guild.id,
+                    Weekly.lookup == lookup,
+                )
+                .options(selectinload(Weekly.success_gifs))
             )
         ).scalar_one_or_none()
 
@@ -253,11 +345,15 @@ async def addfailure(interaction: discord.Interaction, lookup: str, url: str) ->
         )
         return
 
-    with Session.begin() as session:
-        countdown = session.execute(
-            sa.select(Weekly).filter(
-                Weekly.guild_id == interaction.guild.id,
-                Weekly.lookup == lookup,
+    async with Session.begin() as session:
+        countdown = (
+            await session.execute(
+                sa.select(Weekly)
+                .filter(
+                    Weekly.guild_id == interaction.guild.id,
+                    Weekly.lookup == lookup,
+                )
+                .options(selectinload(Weekly.failure_gifs))
             )
         ).scalar_one_or_none()
 
@@ -300,11 +396,15 @@ async def successlist(interaction: discord.Interaction, lookup: str) -> None:
         )
         return
 
-    with Session.begin() as session:
-        countdown = session.execute(
-            sa.select(Weekly).filter(
-                Weekly.guild_id == interaction.guild.id,
-                Weekly.lookup == lookup,
+    async with Session.begin() as session:
+        countdown = (
+            await session.execute(
+                sa.select(Weekly)
+                .filter(
+                    Weekly.guild_id == interaction.guild.id,
+                    Weekly.lookup == lookup,
+                )
+                .options(selectinload(Weekly.success_gifs))
             )
         ).scalar_one_or_none()
 
@@ -339,11 +439,15 @@ async def failurelist(interaction: discord.Interaction, lookup: str) -> None:
         )
         return
 
-    with Session.begin() as session:
-        countdown = session.execute(
-            sa.select(Weekly).filter(
-                Weekly.guild_id == interaction.guild.id,
-                Weekly.lookup == lookup,
+    async with Session.begin() as session:
+        countdown = (
+            await session.execute(
+                sa.select(Weekly)
+                .filter(
+                    Weekly.guild_id == interaction.guild.id,
+                    Weekly.lookup == lookup,
+                )
+                .options(selectinload(Weekly.failure_gifs))
             )
         ).scalar_one_or_none()
 
@@ -381,11 +485,15 @@ async def removesuccess(
         )
         return
 
-    with Session.begin() as session:
-        countdown = session.execute(
-            sa.select(Weekly).filter(
-                Weekly.guild_id == interaction.guild.id,
-                Weekly.lookup == lookup,
+    async with Session.begin() as session:
+        countdown = (
+            await session.execute(
+                sa.select(Weekly)
+                .filter(
+                    Weekly.guild_id == interaction.guild.id,
+                    Weekly.lookup == lookup,
+                )
+                .options(selectinload(Weekly.success_gifs))
             )
         ).scalar_one_or_none()
 
@@ -409,7 +517,7 @@ async def removesuccess(
             )
             return
 
-        session.delete(gif)
+        await session.delete(gif)
 
     await interaction.response.send_message(
         f"Success gif removed from countdown `{lookup}`."
@@ -432,11 +540,15 @@ async def removefailure(
         )
         return
 
-    with Session.begin() as session:
-        countdown = session.execute(
-            sa.select(Weekly).filter(
-                Weekly.guild_id == interaction.guild.id,
-                Weekly.lookup == lookup,
+    async with Session.begin() as session:
+        countdown = (
+            await session.execute(
+                sa.select(Weekly)
+                .filter(
+                    Weekly.guild_id == interaction.guild.id,
+                    Weekly.lookup == lookup,
+                )
+                .options(selectinload(Weekly.failure_gifs))
             )
         ).scalar_one_or_none()
 
@@ -460,7 +572,7 @@ async def removefailure(
             )
             return
 
-        session.delete(gif)
+        await session.delete(gif)
 
     await interaction.response.send_message(
         f"Failure gif removed from countdown `{lookup}`."
@@ -468,36 +580,50 @@ async def removefailure(
 
 
 @weekly.command(description="List all the countdowns for this server.", name="list")
-async def weeklylist(interaction: discord.Interaction) -> None:
+@discord.app_commands.describe(page="Which page of countdowns to show.")
+async def weeklylist(
+    interaction: discord.Interaction,
+    page: discord.app_commands.Range[int, 1] = 1,
+) -> None:
     if interaction.guild is None or interaction.channel is None:
         await interaction.response.send_message(
             "This command must be used in a server."
         )
         return
 
-    with Session.begin() as session:
+    offset = (page - 1) * LIST_PAGE_SIZE
+
+    async with Session.begin() as session:
+        # The job might not have got to anything that's only just come round yet, and it
+        #  needs to have for the order to be right, so catch this guild's up first
+        await roll(session, Weekly.guild_id == interaction.guild.id)
+
         countdowns = (
-            session.execute(
-                sa.select(Weekly).filter(
+            await session.scalars(
+                sa.select(Weekly)
+                .filter(
                     Weekly.guild_id == interaction.guild.id,
                 )
+                .order_by(Weekly.next_occurrence.nulls_last(), Weekly.id)
+                .offset(offset)
+                .limit(LIST_PAGE_SIZE)
             )
-            .scalars()
-            .all()
-        )
+        ).all()
 
         if len(countdowns) == 0:
-            await interaction.response.send_message("No countdowns for this server.")
+            await interaction.response.send_message(
+                "No countdowns for this server."
+                if page == 1
+                else f"There are no countdowns on page {page}."
+            )
             return
 
         description = ""
 
-        for i, countdown in enumerate(
-            sorted(countdowns, key=lambda c: get_next_timestamp(c.timestamp)[0])
-        ):
-            timestamp = get_next_timestamp(countdown.timestamp)[0]
+        for i, countdown in enumerate(countdowns, start=offset + 1):
+            timestamp = next_occurrence(countdown)[0]
 
-            description += f"{i+1}) {string.capwords(countdown.lookup)} - <t:{timestamp}:R> on <t:{timestamp}>\n"
+            description += f"{i}) {string.capwords(countdown.lookup)} - <t:{timestamp}:R> on <t:{timestamp}>\n"
 
         embed = discord.Embed(
             title="Weekly Countdowns",
@@ -508,5 +634,12 @@ async def weeklylist(interaction: discord.Interaction) -> None:
         await interaction.response.send_message(embed=embed)
 
 
-async def setup(bot: commands.Bot) -> None:
+async def setup(bot: Himari) -> None:
     bot.tree.add_command(weekly)
+    bot.jobs.register(KIND, roll_forward)
+    # Picks up any weeklies from before the occurrences were kept, and when to look next
+    await reschedule()
+
+
+async def teardown(bot: Himari) -> None:
+    bot.jobs.unregister(KIND)
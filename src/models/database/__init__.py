@@ -11,10 +11,14 @@ from .club_member import ClubMember as ClubMember
 from .countdown import Countdown as Countdown
 from .countdown_image import CountdownImage as CountdownImage
 from .failure import Failure as Failure
+from .feed_webhook import FeedWebhook as FeedWebhook
 from .j_novel import JNovel as JNovel
+from .job import Job as Job
 from .manga import Manga as Manga
 from .manga_followers import MangaFollower as MangaFollower
 from .nyaa import Nyaa as Nyaa
 from .nyaa_follower import NyaaFollower as NyaaFollower
+from .nyaa_seen import NyaaSeen as NyaaSeen
+from .poll_cursor import PollCursor as PollCursor
 from .success import Success as Success
 from .daily import Daily as Daily
@@ -0,0 +1,16 @@
+from sqlalchemy import BigInteger
+from sqlalchemy.orm import Mapped, mapped_column
+
+from src.models.database import Base
+
+
+class FeedWebhook(Base):
+    __tablename__ = "feed_webhook"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    # Snowflakes, so they need 64 bits
+    guild_id: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    channel_id: Mapped[int] = mapped_column(BigInteger, unique=True, nullable=False)
+    # Created the first time something's posted, rather than when the mode's turned on
+    webhook_id: Mapped[int | None] = mapped_column(BigInteger, nullable=True)
+    token: Mapped[str | None] = mapped_column(nullable=True)
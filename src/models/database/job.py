@@ -0,0 +1,27 @@
+from datetime import datetime
+
+from sqlalchemy import DateTime
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.orm import Mapped, mapped_column
+
+from src.models.database import Base
+
+
+class Job(Base):
+    __tablename__ = "job"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    # Which handler runs it, e.g. "daily"
+    kind: Mapped[str] = mapped_column(nullable=False)
+    # Identifies the job within its kind, so rescheduling replaces rather than adds one
+    key: Mapped[str] = mapped_column(unique=True, nullable=False)
+    payload: Mapped[dict] = mapped_column(JSONB, nullable=False, default=dict)
+    due_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), index=True, nullable=False
+    )
+    # Set while someone's running it, if they die it's picked up again once this passes
+    locked_until: Mapped[datetime | None] = mapped_column(
+        DateTime(timezone=True), nullable=True
+    )
+    # Failed runs in a row, for backing off
+    attempts: Mapped[int] = mapped_column(nullable=False, default=0)
@@ -1,5 +1,7 @@
 import typing
+from datetime import datetime
 
+from sqlalchemy import BigInteger, DateTime
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from src.models.database import Base
@@ -17,8 +19,18 @@ class Manga(Base):
     mangadex_id: Mapped[str] = mapped_column(nullable=False)
     cover: Mapped[str | None] = mapped_column(nullable=True)
     latest_chapter_id: Mapped[str] = mapped_column(nullable=True)
+    # When the latest chapter posted was published, only chapters after it are new
+    latest_published_at: Mapped[datetime | None] = mapped_column(
+        DateTime(timezone=True), nullable=True
+    )
+    # How far along this follow's been brought, behind its manga's fetch cursor (in poll_cursor) while posts to it fail
+    polled_at: Mapped[datetime | None] = mapped_column(
+        DateTime(timezone=True), nullable=True
+    )
     guild_id: Mapped[int] = mapped_column(nullable=False)
     channel_id: Mapped[int] = mapped_column(nullable=False)
+    # Only used when every subscription gets its own notification role, a snowflake so needs 64 bits
+    role_id: Mapped[int | None] = mapped_column(BigInteger, nullable=True)
 
     followers: Mapped[list["MangaFollower"]] = relationship(
         "MangaFollower", back_populates="manga"
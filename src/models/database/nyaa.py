@@ -1,5 +1,6 @@
 import typing
 
+from sqlalchemy import BigInteger
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from src.models.database import Base
@@ -18,6 +19,8 @@ class Nyaa(Base):
     channel_id: Mapped[int] = mapped_column(nullable=False)
     guild_id: Mapped[int] = mapped_column(nullable=False)
     creator_id: Mapped[int] = mapped_column(nullable=False)
+    # Only used when every subscription gets its own notification role, a snowflake so needs 64 bits
+    role_id: Mapped[int | None] = mapped_column(BigInteger, nullable=True)
 
     followers: Mapped[list["NyaaFollower"]] = relationship(
         "NyaaFollower", back_populates="seed"
@@ -14,6 +14,6 @@ class NyaaFollower(Base):
 
     id: Mapped[int] = mapped_column(primary_key=True)
     user_id: Mapped[int] = mapped_column(nullable=False)
-    nyaa_id: Mapped[str] = mapped_column(ForeignKey("nyaa.id"), nullable=False)
+    nyaa_id: Mapped[int] = mapped_column(ForeignKey("nyaa.id"), nullable=False)
 
     seed: Mapped["Nyaa"] = relationship("Nyaa", back_populates="followers")
@@ -0,0 +1,15 @@
+from sqlalchemy import ForeignKey, UniqueConstraint
+from sqlalchemy.orm import Mapped, mapped_column
+
+from src.models.database import Base
+
+
+class NyaaSeen(Base):
+    __tablename__ = "nyaa_seen"
+    __table_args__ = (UniqueConstraint("nyaa_id", "infohash"),)
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    nyaa_id: Mapped[int] = mapped_column(
+        ForeignKey("nyaa.id", ondelete="CASCADE"), index=True, nullable=False
+    )
+    infohash: Mapped[str] = mapped_column(nullable=False)
@@ -0,0 +1,12 @@
+from sqlalchemy.orm import Mapped, mapped_column
+
+from src.models.database import Base
+
+
+class PollCursor(Base):
+    __tablename__ = "poll_cursor"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    # What's being polled, e.g. "j_novel_events"
+    source: Mapped[str] = mapped_column(unique=True, nullable=False)
+    cursor: Mapped[str] = mapped_column(nullable=False)
@@ -16,6 +16,8 @@ class Weekly(Base):
     user_id: Mapped[int] = mapped_column(index=True, nullable=False)
     timestamp: Mapped[int] = mapped_column(nullable=False)
     lookup: Mapped[str] = mapped_column(nullable=False)
+    # When it next comes round, as a unix timestamp, kept up to date by the weekly job
+    next_occurrence: Mapped[int | None] = mapped_column(index=True, nullable=True)
 
     success_gifs: Mapped[list["Success"]] = relationship(
         "Success", back_populates="weekly"
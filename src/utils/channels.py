@@ -0,0 +1,48 @@
+import time
+
+import discord
+
+from src.utils import get_channel
+
+# How long a channel that couldn't be found is assumed to still be gone
+MISSING_TTL = 15 * 60
+
+
+class ChannelCache:
+    """
+    Resolves the channels subscriptions post to, remembering the ones that are gone.
+
+    Channels that do exist are already in discord.py's cache, it's the missing ones that
+    cost a REST call each time, so those are what gets kept here.
+    """
+
+    def __init__(self, ttl: float = MISSING_TTL):
+        self._ttl = ttl
+        # Channel id to when we should look for it again
+        self._missing: dict[int, float] = {}
+
+    def missing(self, channel_id: int) -> bool:
+        expires = self._missing.get(channel_id)
+
+        if expires is None:
+            return False
+
+        if expires <= time.monotonic():
+            del self._missing[channel_id]
+            return False
+
+        return True
+
+    async def get(self, guild: discord.Guild, channel_id: int) -> discord.Thread | discord.TextChannel | None:
+        if self.missing(channel_id):
+            return None
+
+        channel = await get_channel(guild, channel_id)
+
+        if channel is None:
+            self._missing[channel_id] = time.monotonic() + self._ttl
+
+        return channel
+
+    def forget(self, channel_id: int):
+        self._missing.pop(channel_id, None)
@@ -0,0 +1,159 @@
+import asyncio
+import hashlib
+import logging
+import os
+import pathlib
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qs, urlparse
+
+import aiohttp
+import discord
+
+logger = logging.getLogger(__name__)
+
+COVER_URL = "https://uploads.mangadex.org/covers/{}/{}"
+
+# Where covers are kept between restarts, and how many of them are kept in memory and on disk
+COVER_CACHE_DIR = pathlib.Path(os.getenv("COVER_CACHE_DIR", ".cache/covers"))
+MEMORY_LIMIT = 64
+DISK_LIMIT = 1024
+# MangaDex serves 256 and 512 pixel wide thumbnails of every cover, set this to use one of them
+THUMBNAIL_SIZE = os.getenv("MANGADEX_COVER_SIZE")
+# How long before an attachment URL expires we stop handing it out
+URL_MARGIN = 60 * 60
+
+Key = tuple[str, str]
+
+
+def _expiry(url: str) -> float | None:
+    """
+    When a Discord attachment URL stops working, as a unix timestamp, None if it doesn't say.
+    """
+    expires = parse_qs(urlparse(url).query).get("ex")
+
+    try:
+        return int(expires[0], 16) if expires else None
+    except ValueError:
+        return None
+
+
+class CoverCache:
+    """
+    MangaDex covers, keyed by (mangadex_id, cover filename), so each one is only downloaded the once.
+
+    Recently used covers are kept in memory, with a bigger set on disk. Once a cover has been
+    uploaded to Discord, later posts link to that attachment rather than uploading it again.
+    """
+
+    def __init__(
+        self,
+        directory: pathlib.Path = COVER_CACHE_DIR,
+        memory: int = MEMORY_LIMIT,
+        disk: int = DISK_LIMIT,
+        size: str | None = THUMBNAIL_SIZE,
+    ):
+        self._directory = directory
+        self._memory_limit = memory
+        self._disk_limit = disk
+        self._size = size
+        self._memory: OrderedDict[Key, bytes] = OrderedDict()
+        # Attachment URLs of covers already on Discord, and when they expire
+        self._urls: dict[Key, tuple[str, float | None]] = {}
+
+    @property
+    def filename(self) -> str:
+        """
+        What to call the attachment, thumbnails are always JPEGs.
+        """
+        return "cover.jpg" if self._size is not None else "cover.png"
+
+    def _url(self, key: Key) -> str:
+        mangadex_id, cover = key
+        url = COVER_URL.format(mangadex_id, cover)
+        return f"{url}.{self._size}.jpg" if self._size is not None else url
+
+    def _path(self, key: Key) -> pathlib.Path:
+        return self._directory / hashlib.sha256(self._url(key).encode()).hexdigest()
+
+    def url(self, key: Key) -> str | None:
+        """
+        The attachment URL this cover was last uploaded under, if it's still good for a while.
+        """
+        if (cached := self._urls.get(key)) is None:
+            return None
+
+        url, expires = cached
+
+        if expires is not None and expires - URL_MARGIN < time.time():
+            del self._urls[key]
+            return None
+
+        return url
+
+    def uploaded(self, key: Key, message: discord.Message | None):
+        """
+        Remember where a cover ended up, from the message it was first uploaded with.
+        """
+        if message is None or not message.attachments:
+            return
+
+        url = message.attachments[0].url
+        self._urls[key] = (url, _expiry(url))
+
+    def _remember(self, key: Key, data: bytes):
+        self._memory[key] = data
+        self._memory.move_to_end(key)
+
+        while len(self._memory) > self._memory_limit:
+            self._memory.popitem(last=False)
+
+    def _read(self, key: Key) -> bytes | None:
+        path = self._path(key)
+
+        try:
+            data = path.read_bytes()
+        except FileNotFoundError:
+            return None
+
+        # Bumped, so the least recently used are the ones to go
+        path.touch()
+        return data
+
+    def _write(self, key: Key, data: bytes):
+        self._directory.mkdir(parents=True, exist_ok=True)
+        self._path(key).write_bytes(data)
+
+        files = sorted(self._directory.iterdir(), key=lambda path: path.stat().st_mtime)
+
+        for path in files[: max(len(files) - self._disk_limit, 0)]:
+            path.unlink(missing_ok=True)
+
+    async def get(self, session: aiohttp.ClientSession, key: Key) -> bytes | None:
+        """
+        Get a cover's bytes, from memory, disk or MangaDex in that order.
+        """
+        if (data := self._memory.get(key)) is not None:
+            self._memory.move_to_end(key)
+            return data
+
+        try:
+            data = await asyncio.to_thread(self._read, key)
+        except OSError as e:
+            logger.warning(f"Couldn't read cached cover {key}: {e!r}")
+            data = None
+
+        if data is None:
+            async with session.get(self._url(key)) as res:
+                if res.status != 200:
+                    return None
+
+                data = await res.read()
+
+            try:
+                await asyncio.to_thread(self._write, key, data)
+            except OSError as e:
+                logger.warning(f"Couldn't cache cover {key}: {e!r}")
+
+        self._remember(key, data)
+        return data
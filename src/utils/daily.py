@@ -1,87 +1,101 @@
-import asyncio
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 
-import pytz
 import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import insert
 
 from src import Session, bot
-from src.models.database import Daily
+from src.models.database import Daily, Job
+from src.utils.jobs import JobQueue
 from src.views.daily import DailyView
 
+KIND = "daily"
+INTERVAL = timedelta(days=1)
 
-def sleep_amount(timestamp: int) -> int:
-    tz = pytz.timezone("America/New_York")
-    now = datetime.now(tz=tz)
-    dt = datetime.fromtimestamp(timestamp, tz=tz) + timedelta(days=1)
-    sleep_time = int(dt.timestamp()) - int(now.timestamp())
-    # Lets take off 5 minutes, just to be safe.
-    sleep_time -= 300
-    return sleep_time
 
+def next_reminder(timestamp: int) -> datetime:
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc) + INTERVAL
 
-async def handle_daily(
-    id: int, timestamp: int, creator_id: int, handler: "DailyHandler"
-):
-    amt = sleep_amount(timestamp)
-    amt = max(0, amt)
 
-    await asyncio.sleep(amt)
+async def handle_daily(creator_id: int, handler: "DailyHandler") -> datetime | None:
+    """
+    Send someone their daily reminder, returning when the next one's due, or None if they're gone.
+    """
     await bot.wait_until_ready()
 
-    view = DailyView(creator_id, handler)
     user = bot.get_user(creator_id)
 
     if user is None:
-        with Session.begin() as db:
-            db.execute(sa.delete(Daily).where(Daily.id == id))
-        return
+        async with Session.begin() as db:
+            await db.execute(sa.delete(Daily).where(Daily.creator_id == creator_id))
+        return None
 
-    with Session.begin() as db:
-        daily = db.get(Daily, id)
+    async with Session() as db:
+        daily = await db.scalar(sa.select(Daily).where(Daily.creator_id == creator_id))
 
-        if daily is not None:
-            daily.timestamp = int(datetime.now().timestamp()) + 300
-            db.add(daily)
+    # Cancelled without the job going with it
+    if daily is None:
+        return None
 
-        message = f"""Daily reminder! {daily.message if daily is not None else ""}
+    message = f"""Daily reminder! {daily.message or ""}
 
 Press Done once you have completed your daily tasks, and are ready to be notified again in 24 hours.
 If you wish to cancel your daily counter, press Cancel."""
 
-    await user.send(message, view=view)
-    handler.schedule()
+    # Sent first, so if it fails the job's retried rather than skipped
+    await user.send(message, view=DailyView(creator_id, handler))
+
+    timestamp = int(datetime.now().timestamp())
+
+    async with Session.begin() as db:
+        await db.execute(sa.update(Daily).where(Daily.creator_id == creator_id).values(timestamp=timestamp))
+
+    # Until they press Done, remind them again this time tomorrow
+    return next_reminder(timestamp)
 
 
 class DailyHandler:
-    _scheduled: dict[int, asyncio.Task[None]] = {}
-
-    def schedule(self):
-        loop = asyncio.get_event_loop()
-
-        with Session.begin() as db:
-            dailies = db.execute(sa.select(Daily)).scalars().all()
-            user_ids = [daily.creator_id for daily in dailies]
-
-            # Check if any have been deleted
-            for user_id, task in self._scheduled.copy().items():
-                # If it is one we want scheduled, skip here, we'll handle in the next loop
-                if user_id in user_ids:
-                    continue
-                # Otherwise cancel and delete it
-                task.cancel()
-                del self._scheduled[user_id]
-
-            for daily in dailies:
-                task = self._scheduled.get(daily.creator_id)
-
-                # If task is None, they haven't been scheduled yet
-                #  otherwise if it's done, it's time to reschedule
-                if task is None or task.done():
-                    self._scheduled[daily.creator_id] = loop.create_task(
-                        handle_daily(daily.id, daily.timestamp, daily.creator_id, self)
-                    )
+    """
+    Daily reminders, each one a job in the job table keyed on whose it is.
+    """
+
+    def __init__(self, jobs: JobQueue):
+        self._jobs = jobs
+
+    @staticmethod
+    def _key(creator_id: int) -> str:
+        return f"{KIND}:{creator_id}"
+
+    async def start(self):
+        # Dailies from before they were jobs get one, a day after they were last reset
+        async with Session.begin() as db:
+            await db.execute(
+                insert(Job)
+                .from_select(
+                    ["kind", "key", "payload", "due_at", "attempts"],
+                    sa.select(
+                        sa.literal(KIND),
+                        sa.literal(f"{KIND}:") + sa.cast(Daily.creator_id, sa.String),
+                        sa.func.jsonb_build_object("creator_id", Daily.creator_id),
+                        sa.func.to_timestamp(Daily.timestamp + int(INTERVAL.total_seconds())),
+                        sa.literal(0),
+                    ),
+                )
+                .on_conflict_do_nothing(index_elements=[Job.key])
+            )
+
+        self._jobs.register(KIND, self._run)
+
+    async def _run(self, job: Job) -> datetime | None:
+        return await handle_daily(job.payload["creator_id"], self)
+
+    async def schedule(self, creator_id: int, timestamp: int):
+        """
+        (Re)schedule someone's reminder, for a day after `timestamp`.
+        """
+        await self._jobs.schedule(KIND, self._key(creator_id), next_reminder(timestamp), {"creator_id": creator_id})
+
+    async def unschedule(self, creator_id: int):
+        await self._jobs.unschedule(self._key(creator_id))
 
     def cancel(self):
-        for task in self._scheduled.values():
-            task.cancel()
-        self._scheduled.clear()
+        self._jobs.unregister(KIND)
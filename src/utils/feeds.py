@@ -0,0 +1,105 @@
+import asyncio
+import calendar
+import logging
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+
+import feedparser
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True, slots=True)
+class FeedEntry:
+    """
+    Just the parts of a feed entry we actually use, so they're cheap to send back from a worker.
+    """
+
+    id: str
+    title: str
+    link: str
+    # Seconds since the epoch
+    published: float | None = None
+    # The enclosure, which is the cover image for J-Novel
+    cover: str | None = None
+    # Nyaa specific
+    infohash: str | None = None
+    category: str | None = None
+    size: str | None = None
+
+
+@dataclass
+class ParseMetrics:
+    parsed: int = 0
+    # Seconds spent waiting for a worker, and then parsing
+    queue_wait_total: float = 0.0
+    queue_wait_max: float = 0.0
+    parse_total: float = 0.0
+    parse_max: float = 0.0
+
+    def record(self, queue_wait: float, parse: float):
+        self.parsed += 1
+        self.queue_wait_total += queue_wait
+        self.queue_wait_max = max(self.queue_wait_max, queue_wait)
+        self.parse_total += parse
+        self.parse_max = max(self.parse_max, parse)
+
+    @property
+    def queue_wait_avg(self) -> float:
+        return self.queue_wait_total / self.parsed if self.parsed else 0.0
+
+    @property
+    def parse_avg(self) -> float:
+        return self.parse_total / self.parsed if self.parsed else 0.0
+
+
+def _entry(entry: feedparser.FeedParserDict) -> FeedEntry:
+    published = entry.get("published_parsed")
+    cover = next((link.href for link in entry.get("links", []) if link.get("rel") == "enclosure"), None)
+
+    return FeedEntry(
+        id=str(entry.get("id", "")),
+        title=str(entry.get("title", "")),
+        link=str(entry.get("link", "")),
+        published=calendar.timegm(published) if published else None,
+        cover=cover,
+        infohash=entry.get("nyaa_infohash"),
+        category=entry.get("nyaa_category"),
+        size=entry.get("nyaa_size"),
+    )
+
+
+def _parse(body: bytes) -> tuple[float, float, list[FeedEntry]]:
+    # Runs in the worker, wall clock times since monotonic clocks aren't shared between processes
+    started = time.time()
+    entries = [_entry(entry) for entry in feedparser.parse(body).entries]
+    return started, time.time(), entries
+
+
+class FeedPool:
+    """
+    Parses feeds in worker processes, so a big document doesn't hold up the event loop.
+    """
+
+    def __init__(self, workers: int = 2, queue: int = 8):
+        # Spawned rather than forked, forking a process with threads (and a running loop) in it isn't safe
+        self._executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        # Bounds how many documents can be waiting on, or in, the pool at once
+        self._slots = asyncio.Semaphore(queue)
+        self.metrics = ParseMetrics()
+
+    async def parse(self, body: bytes) -> list[FeedEntry]:
+        async with self._slots:
+            submitted = time.time()
+            started, finished, entries = await asyncio.get_running_loop().run_in_executor(self._executor, _parse, body)
+
+        queue_wait, parse = max(started - submitted, 0), finished - started
+        self.metrics.record(queue_wait, parse)
+        logger.debug(f"Parsed feed of {len(entries)} entries in {parse:.3f}s after waiting {queue_wait:.3f}s")
+
+        return entries
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,189 @@
+import asyncio
+import hashlib
+import time
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from typing import Mapping
+
+import aiohttp
+
+# Total connections kept open across every upstream
+POOL_LIMIT = 100
+# Per-host cap, so one slow upstream can't eat the whole pool
+POOL_LIMIT_PER_HOST = 10
+# How long resolved hostnames are reused before looking them up again
+DNS_CACHE_TTL = 300
+
+DEFAULT_TIMEOUT = aiohttp.ClientTimeout(total=30, connect=10)
+
+
+def create_session() -> aiohttp.ClientSession:
+    """
+    Create the HTTP client shared by everything for the lifetime of the bot.
+    """
+    connector = aiohttp.TCPConnector(
+        limit=POOL_LIMIT,
+        limit_per_host=POOL_LIMIT_PER_HOST,
+        ttl_dns_cache=DNS_CACHE_TTL,
+        keepalive_timeout=60,
+    )
+
+    return aiohttp.ClientSession(connector=connector, timeout=DEFAULT_TIMEOUT)
+
+
+def retry_after(headers: Mapping[str, str] | None) -> float | None:
+    """
+    Get the number of seconds a Retry-After header asks us to wait, if there is one.
+    """
+    if headers is None or (value := headers.get("Retry-After")) is None:
+        return
+
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+
+    # Otherwise it's an HTTP date
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return
+
+
+@dataclass
+class Validators:
+    etag: str | None = None
+    last_modified: str | None = None
+    digest: str | None = None
+
+
+class ConditionalGet:
+    """
+    Fetches URLs with If-None-Match/If-Modified-Since, remembering the validators
+    and a hash of the last body seen for each URL.
+    """
+
+    def __init__(self):
+        self._validators: dict[str, Validators] = {}
+
+    def forget(self, url: str):
+        """
+        Drop what we know about a URL, so the next fetch returns the body again.
+        """
+        self._validators.pop(url, None)
+
+    async def fetch(self, session: aiohttp.ClientSession, url: str) -> bytes | None:
+        """
+        Returns the body, or None if nothing has changed since the last fetch.
+
+        Raises aiohttp.ClientResponseError if the upstream returns an error.
+        """
+        validators = self._validators.setdefault(url, Validators())
+        headers = {}
+
+        if validators.etag is not None:
+            headers["If-None-Match"] = validators.etag
+        if validators.last_modified is not None:
+            headers["If-Modified-Since"] = validators.last_modified
+
+        async with session.get(url, headers=headers) as resp:
+            if resp.status == 304:
+                return
+
+            # Errors are raised, so callers can tell a failure apart from nothing having changed
+            resp.raise_for_status()
+
+            body = await resp.read()
+
+            validators.etag = resp.headers.get("ETag")
+            validators.last_modified = resp.headers.get("Last-Modified")
+
+        # Plenty of feeds don't send validators (or send new ones for identical content),
+        #  so also compare the body itself against last time.
+        digest = hashlib.blake2b(body, digest_size=16).hexdigest()
+
+        if digest == validators.digest:
+            return
+
+        validators.digest = digest
+
+        return body
+
+
+class TokenBucket:
+    """
+    Allows `rate` acquisitions a second on average, with bursts of up to `capacity`.
+    """
+
+    def __init__(self, rate: float, capacity: int):
+        self._rate = rate
+        self._capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+    async def acquire(self):
+        # Waiters queue up on the lock, so they're let through in the order they arrived
+        async with self._lock:
+            self._refill()
+
+            while self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self._rate)
+                self._refill()
+
+            self._tokens -= 1
+
+
+class CircuitBreaker:
+    """
+    Stops calling an upstream that keeps failing, or that's told us to back off,
+    then lets a single request through to see if it's recovered.
+    """
+
+    def __init__(self, threshold: int = 5, cooldown: float = 60):
+        self._threshold = threshold
+        self._cooldown = cooldown
+        self._failures = 0
+        # When it'll let a request through again, None while it's closed
+        self._until: float | None = None
+        self._probing = False
+
+    @property
+    def remaining(self) -> float | None:
+        """
+        Seconds until requests are let through again, None if they are now.
+        """
+        if self._until is None:
+            return None
+
+        return max(self._until - time.monotonic(), 0) or None
+
+    def allow(self) -> bool:
+        if self._until is None:
+            return True
+
+        if time.monotonic() < self._until or self._probing:
+            return False
+
+        # Half open, only the one request gets to find out if it's back
+        self._probing = True
+        return True
+
+    def success(self):
+        self._failures = 0
+        self._until = None
+        self._probing = False
+
+    def failure(self, retry_after: float | None = None):
+        self._failures += 1
+
+        # A failed probe goes straight back to waiting, as does being told how long to wait
+        if retry_after is not None or self._probing or self._failures >= self._threshold:
+            self._until = time.monotonic() + max(retry_after or 0, self._cooldown if retry_after is None else 0)
+
+        self._probing = False
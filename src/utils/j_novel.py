@@ -1,10 +1,28 @@
-from dataclasses import dataclass
+import asyncio
+import json
+import logging
+import os
+import pathlib
+import time
+from dataclasses import asdict, dataclass
+from datetime import datetime
 
 import aiohttp
 
 from src.utils import search
 
 BASE_URL = "https://labs.j-novel.club"
+PAGE_SIZE = 100
+# Pages fetched at once while paging through the catalog
+PAGE_CONCURRENCY = 4
+
+# How long the catalog is good for before it's fetched again, and where it's kept between restarts
+CATALOG_TTL = 6 * 60 * 60
+CATALOG_PATH = pathlib.Path(os.getenv("J_NOVEL_CATALOG", ".cache/j_novel_catalog.json"))
+# Longest substring of a title word that gets indexed, longer query words are checked by hand
+MAX_KEY = 16
+
+logger = logging.getLogger(__name__)
 
 
 @dataclass
@@ -13,14 +31,23 @@ class Series:
     title: str
     description: str
     cover: str
+    # The id the rest of the v2 API (events and the like) refers to the series by, `id` is the legacy one
+    api_id: str | None = None
 
 
-async def _get_series(session: aiohttp.ClientSession, *, page=0) -> dict | None:
-    limit = 100
+@dataclass
+class Event:
+    id: str
+    name: str
+    # The v2 id of the series it's for
+    series: str | None
+    launch: datetime
+
 
+async def _get_series(session: aiohttp.ClientSession, *, page=0) -> dict | None:
     async with session.get(
         f"{BASE_URL}/app/v2/series",
-        params={"format": "json", "skip": page * limit, "limit": limit},
+        params={"format": "json", "skip": page * PAGE_SIZE, "limit": PAGE_SIZE},
     ) as resp:
         if resp.status > 299:
             return
@@ -28,15 +55,17 @@ async def _get_series(session: aiohttp.ClientSession, *, page=0) -> dict | None:
         return await resp.json()
 
 
-async def get_all_series() -> list[Series] | None:
+async def get_all_series(session: aiohttp.ClientSession, concurrency: int = PAGE_CONCURRENCY) -> list[Series] | None:
+    """
+    Page through the whole catalog, a few pages at a time. None if any page couldn't be fetched.
+    """
     results: list[Series] = []
+    page = 0
 
-    async with aiohttp.ClientSession() as session:
-        page = 0
-
-        while True:
-            data = await _get_series(session, page=page)
+    while True:
+        pages = await asyncio.gather(*(_get_series(session, page=page + i) for i in range(concurrency)))
 
+        for data in pages:
             if data is None:
                 return
 
@@ -47,17 +76,168 @@ async def get_all_series() -> list[Series] | None:
                         title=series["title"],
                         description=series["description"],
                         cover=series["cover"]["coverUrl"],
+                        api_id=series.get("id"),
                     )
                 )
 
-            if data["pagination"]["lastPage"]:
+            # Anything fetched past the last page is empty, so can just be ignored
+            if data["pagination"]["lastPage"] or len(data["series"]) < PAGE_SIZE:
                 return results
 
-            page += 1
+        page += concurrency
+
+
+async def get_events(session: aiohttp.ClientSession, since: datetime, until: datetime) -> list[Event]:
+    """
+    Get every release event launched between `since` and `until`, oldest first.
+
+    Raises aiohttp.ClientResponseError if the listing can't be fetched, so the poller can back off.
+    """
+    events: list[Event] = []
+    page = 0
+
+    while True:
+        async with session.get(
+            f"{BASE_URL}/app/v2/events",
+            params={
+                "format": "json",
+                "start_date": since.isoformat(),
+                "end_date": until.isoformat(),
+                "sort": "launch",
+                "skip": page * PAGE_SIZE,
+                "limit": PAGE_SIZE,
+            },
+        ) as resp:
+            resp.raise_for_status()
+
+            data = await resp.json()
+
+        for event in data["events"]:
+            events.append(
+                Event(
+                    id=event["id"],
+                    name=event.get("name", ""),
+                    series=event.get("serieId"),
+                    launch=datetime.fromisoformat(event["launch"].replace("Z", "+00:00")),
+                )
+            )
+
+        if data["pagination"]["lastPage"] or len(data["events"]) < PAGE_SIZE:
+            break
+
+        page += 1
+
+    return sorted(events, key=lambda event: event.launch)
+
+
+def _keys(word: str) -> set[str]:
+    """
+    Every substring of a word, up to MAX_KEY long.
+    """
+    return {word[i:j] for i in range(len(word)) for j in range(i + 1, min(i + MAX_KEY, len(word)) + 1)}
+
+
+class Catalog:
+    """
+    The whole J-Novel series catalog, kept in memory and on disk, and indexed for searching.
+
+    Every substring of every title word is indexed, so a lookup gives exactly what `search`
+    would have over the whole catalog, without going over all of it.
+    """
+
+    def __init__(self, path: pathlib.Path = CATALOG_PATH, ttl: float = CATALOG_TTL):
+        self._path = path
+        self._ttl = ttl
+        self._series: list[Series] = []
+        self._ids: dict[str, Series] = {}
+        self._api_ids: dict[str, Series] = {}
+        self._index: dict[str, set[int]] = {}
+        # When the catalog was fetched, as a unix timestamp, None until there's one
+        self.updated: float | None = None
+        self._lock = asyncio.Lock()
+
+    def __len__(self) -> int:
+        return len(self._series)
+
+    @property
+    def stale(self) -> bool:
+        return self.updated is None or time.time() - self.updated > self._ttl
+
+    def _build(self, series: list[Series], updated: float | None):
+        index: dict[str, set[int]] = {}
+
+        for i, item in enumerate(series):
+            for word in item.title.lower().split():
+                for key in _keys(word):
+                    index.setdefault(key, set()).add(i)
+
+        self._series = series
+        self._ids = {item.id: item for item in series}
+        self._api_ids = {item.api_id: item for item in series if item.api_id is not None}
+        self._index = index
+        self.updated = updated
+
+    def load(self):
+        """
+        Pick up the snapshot left on disk, if there is one.
+        """
+        try:
+            data = json.loads(self._path.read_text())
+            series = [Series(**series) for series in data["series"]]
+            # Snapshots from before the v2 ids were kept are refetched straight away
+            updated = data["updated"] if all(item.api_id is not None for item in series) else None
+            self._build(series, updated)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Couldn't load the J-Novel catalog snapshot: {e!r}")
+
+    def _save(self):
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        self._path.write_text(json.dumps({"updated": self.updated, "series": [asdict(s) for s in self._series]}))
+
+    async def refresh(self, session: aiohttp.ClientSession, force: bool = False):
+        async with self._lock:
+            # Someone else might've just done it
+            if not force and not self.stale:
+                return
+
+            series = await get_all_series(session)
+
+            if series is None:
+                logger.warning("Couldn't fetch the J-Novel catalog, keeping the one we have")
+                return
+
+            self._build(series, time.time())
+
+            try:
+                await asyncio.to_thread(self._save)
+            except OSError as e:
+                logger.warning(f"Couldn't save the J-Novel catalog snapshot: {e!r}")
+
+    def get(self, id: str) -> Series | None:
+        return self._ids.get(id)
+
+    def by_api_id(self, api_id: str) -> Series | None:
+        return self._api_ids.get(api_id)
+
+    def search(self, query: str) -> list[Series]:
+        words = query.lower().split()
+
+        if not words:
+            return list(self._series)
+
+        candidates: set[int] | None = None
+
+        # Rarest first, so the intersection shrinks as fast as it can
+        for key in sorted((word[:MAX_KEY] for word in words), key=lambda key: len(self._index.get(key, ()))):
+            ids = self._index.get(key, set())
+            candidates = set(ids) if candidates is None else candidates & ids
 
+            if not candidates:
+                return []
 
-async def search_series(query: str) -> list[Series]:
-    series = await get_all_series()
-    assert series is not None
+        assert candidates is not None
 
-    return [s for s in series if search(s.title, query)]
+        # Only words longer than MAX_KEY could still be wrong, but checking them all is cheap enough
+        return [self._series[i] for i in sorted(candidates) if search(self._series[i].title, query)]
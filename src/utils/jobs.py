@@ -0,0 +1,189 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable
+
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import insert
+
+from src import Session
+from src.models.database import Job
+
+logger = logging.getLogger(__name__)
+
+# Jobs taken per claim, so catching up after downtime goes a batch at a time
+CLAIM_LIMIT = int(os.getenv("JOB_CLAIM_LIMIT", 20))
+# How long a claimed job is held for before someone else may take it
+LEASE = timedelta(minutes=5)
+# Longest the runner sleeps without looking, so jobs added by another instance aren't missed for long
+POLL_INTERVAL = 60
+# Failed jobs are retried after RETRY_BASE seconds, doubling each time they fail again, up to RETRY_MAX
+RETRY_BASE = 30
+RETRY_MAX = 60 * 60
+
+# Given the claimed job, returns when to run it next, or None if it's finished with
+Handler = Callable[[Job], Awaitable[datetime | None]]
+
+
+def utcnow() -> datetime:
+    return datetime.now(tz=timezone.utc)
+
+
+class JobQueue:
+    """
+    Runs jobs kept in the `job` table when they fall due, so they survive restarts.
+
+    Due jobs are claimed with a lease in one `FOR UPDATE SKIP LOCKED` query, so any number of
+    instances can share the table without running a job twice. There's only ever one row per
+    key, so however long the bot was down for, an overdue job runs once on startup, and then
+    its handler says when it's next due.
+    """
+
+    def __init__(self, limit: int = CLAIM_LIMIT):
+        self._limit = limit
+        self._handlers: dict[str, Handler] = {}
+        self._wake = asyncio.Event()
+        self._task: asyncio.Task[None] | None = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is None:
+            return
+
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    def register(self, kind: str, handler: Handler):
+        self._handlers[kind] = handler
+        # Might have been sat on due jobs it couldn't run
+        self._wake.set()
+
+    def unregister(self, kind: str):
+        self._handlers.pop(kind, None)
+
+    async def schedule(self, kind: str, key: str, due: datetime, payload: dict | None = None):
+        """
+        Add a job, or move it to `due` if there's one with this key already (even if it's running).
+        """
+        payload = payload or {}
+
+        async with Session.begin() as db:
+            await db.execute(
+                insert(Job)
+                .values(kind=kind, key=key, payload=payload, due_at=due, attempts=0)
+                .on_conflict_do_update(
+                    index_elements=[Job.key],
+                    set_={"kind": kind, "payload": payload, "due_at": due, "locked_until": None, "attempts": 0},
+                )
+            )
+
+        if due <= utcnow() + timedelta(seconds=POLL_INTERVAL):
+            self._wake.set()
+
+    async def unschedule(self, key: str):
+        async with Session.begin() as db:
+            await db.execute(sa.delete(Job).where(Job.key == key))
+
+    async def _claim(self) -> list[Job]:
+        now = sa.func.now()
+        due = (
+            sa.select(Job.id)
+            .where(
+                Job.kind.in_(list(self._handlers)),
+                Job.due_at <= now,
+                sa.or_(Job.locked_until.is_(None), Job.locked_until < now),
+            )
+            .order_by(Job.due_at)
+            .limit(self._limit)
+            .with_for_update(skip_locked=True)
+        )
+
+        async with Session.begin() as db:
+            return list(
+                (
+                    await db.scalars(
+                        sa.update(Job)
+                        .where(Job.id.in_(due.scalar_subquery()))
+                        .values(locked_until=now + LEASE, attempts=Job.attempts + 1)
+                        .returning(Job),
+                        execution_options={"synchronize_session": False},
+                    )
+                ).all()
+            )
+
+    async def _next_delay(self) -> float:
+        """
+        Seconds until the next job falls due (or its lease runs out), at most POLL_INTERVAL.
+        """
+        async with Session() as db:
+            due = await db.scalar(
+                sa.select(sa.func.min(sa.func.greatest(Job.due_at, sa.func.coalesce(Job.locked_until, Job.due_at))))
+                .where(Job.kind.in_(list(self._handlers)))
+            )
+
+        if due is None:
+            return POLL_INTERVAL
+
+        return min(max((due - utcnow()).total_seconds(), 0), POLL_INTERVAL)
+
+    async def _execute(self, job: Job):
+        handler = self._handlers.get(job.kind)
+        # Only ours while the lease we took it with is still on it, rescheduling it clears that
+        claimed = sa.and_(Job.id == job.id, Job.locked_until == job.locked_until)
+
+        try:
+            if handler is None:
+                raise LookupError(f"No handler for {job.kind} jobs")
+
+            late = (utcnow() - job.due_at).total_seconds()
+            if late > POLL_INTERVAL:
+                logger.info(f"Catching up on job {job.key}, {late:.0f}s overdue")
+
+            due = await handler(job)
+        except Exception as e:
+            logger.error(f"Error running job {job.key}", exc_info=e)
+
+            retry = min(RETRY_BASE * 2 ** (job.attempts - 1), RETRY_MAX)
+            async with Session.begin() as db:
+                await db.execute(
+                    sa.update(Job)
+                    .where(claimed)
+                    .values(due_at=utcnow() + timedelta(seconds=retry), locked_until=None)
+                )
+            return
+
+        async with Session.begin() as db:
+            if due is None:
+                await db.execute(sa.delete(Job).where(claimed))
+            else:
+                await db.execute(sa.update(Job).where(claimed).values(due_at=due, locked_until=None, attempts=0))
+
+    async def _run(self):
+        while True:
+            self._wake.clear()
+
+            try:
+                jobs = await self._claim() if self._handlers else []
+
+                for job, result in zip(jobs, await asyncio.gather(*map(self._execute, jobs), return_exceptions=True)):
+                    # Left for its lease to run out, then it's tried again
+                    if isinstance(result, Exception):
+                        logger.error(f"Error finishing job {job.key}", exc_info=result)
+
+                # A full batch means there's probably more waiting already
+                if len(jobs) == self._limit:
+                    continue
+
+                delay = await self._next_delay() if self._handlers else POLL_INTERVAL
+            except Exception as e:
+                logger.error("Error in job runner", exc_info=e)
+                delay = POLL_INTERVAL
+
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
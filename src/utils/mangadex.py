@@ -1,8 +1,19 @@
+import asyncio
+import logging
+import time
 from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlparse
 
 import aiohttp
 
+from src.utils.http import CircuitBreaker, TokenBucket, retry_after
+
 BASE_URL = "https://api.mangadex.org"
+# MangaDex allows around 5 requests a second from any one IP
+RATE_LIMIT = 5
+
+logger = logging.getLogger(__name__)
 
 
 @dataclass
@@ -19,22 +30,21 @@ class Chapter:
     title: str
     volume: int | None
     chapter: int
+    published: datetime
 
 
-async def search_manga(search: str) -> list[MangadexManga]:
+async def search_manga(session: aiohttp.ClientSession, search: str) -> list[MangadexManga]:
     """
     Search for manga on MangaDex.
     """
-    async with aiohttp.ClientSession() as session:
-        res = await session.get(
-            f"{BASE_URL}/manga",
-            params={
-                "title": search,
-                "contentRating[]": ["safe", "suggestive", "erotica", "pornographic"],
-                "includes[]": ["cover_art"],
-            },
-        )
-
+    async with session.get(
+        f"{BASE_URL}/manga",
+        params={
+            "title": search,
+            "contentRating[]": ["safe", "suggestive", "erotica", "pornographic"],
+            "includes[]": ["cover_art"],
+        },
+    ) as res:
         data = await res.json()
 
     mangas = []
@@ -63,28 +73,158 @@ async def search_manga(search: str) -> list[MangadexManga]:
     return mangas
 
 
-async def latest_chapter(id: str) -> Chapter | None:
+# Manga per /chapter request, and chapters per page of its response
+BATCH_SIZE = 100
+CHAPTER_LIMIT = 100
+# Most pages followed for one batch in one go, the rest are picked up from where these left off next tick
+MAX_PAGES = 5
+# How far back past the last poll to look again, for clock skew and chapters that take a moment to show up
+OVERLAP = timedelta(minutes=5)
+
+
+def _chapter(data: dict) -> Chapter:
+    return Chapter(
+        id=data["id"],
+        title=data["attributes"]["title"],
+        volume=data["attributes"]["volume"],
+        chapter=data["attributes"]["chapter"],
+        published=datetime.fromisoformat(data["attributes"]["publishAt"]),
+    )
+
+
+async def new_chapters(
+    session: aiohttp.ClientSession,
+    ids: list[str],
+    since: datetime | None = None,
+    bucket: TokenBucket | None = None,
+) -> tuple[dict[str, list[Chapter]], datetime]:
     """
-    Get the chapters of a manga.
+    Get the English chapters of up to BATCH_SIZE manga, newest first, in as few requests as we can.
+
+    With `since`, chapters published from then on are fetched oldest first, so if there are more
+    than MAX_PAGES of them it's the newest that are left for next time. Without it, only the first
+    page of the newest is, which is enough to find the latest chapter of anything that's had one recently.
+
+    Also returns how far along everything's been fetched, which is where the next poll should start.
     """
-    async with aiohttp.ClientSession() as session:
-        res = await session.get(
-            f"{BASE_URL}/manga/{id}/feed",
-            params={
-                "translatedLanguage[]": "en",
-                "order[volume]": "desc",
-                "order[chapter]": "desc",
-                "order[publishAt]": "desc",
-            },
-        )
+    started = datetime.now(tz=timezone.utc)
+    params = {
+        "manga[]": ids,
+        "translatedLanguage[]": "en",
+        "contentRating[]": ["safe", "suggestive", "erotica", "pornographic"],
+        "order[publishAt]": "desc" if since is None else "asc",
+        "limit": CHAPTER_LIMIT,
+    }
 
-        data = await res.json()
+    if since is not None:
+        # MangaDex wants UTC, without an offset
+        params["publishAtSince"] = (since - OVERLAP).astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S")
 
-    for chapter in data["data"]:
-        if chapter["type"] == "chapter" and chapter["attributes"]["translatedLanguage"] == "en":
-            return Chapter(
-                id=chapter["id"],
-                title=chapter["attributes"]["title"],
-                volume=chapter["attributes"]["volume"],
-                chapter=chapter["attributes"]["chapter"],
-            )
+    chapters: dict[str, list[Chapter]] = {}
+    covered = started
+
+    for page in range(MAX_PAGES if since is not None else 1):
+        if bucket is not None:
+            await bucket.acquire()
+
+        async with session.get(f"{BASE_URL}/chapter", params={**params, "offset": page * CHAPTER_LIMIT}) as res:
+            # Errors are raised, so the poller can tell when it's being rate limited
+            res.raise_for_status()
+
+            data = await res.json()
+
+        for chapter in data["data"]:
+            if chapter["type"] != "chapter" or chapter["attributes"]["translatedLanguage"] != "en":
+                continue
+
+            manga = next((relation["id"] for relation in chapter["relationships"] if relation["type"] == "manga"), None)
+
+            if manga is not None:
+                chapters.setdefault(manga, []).append(_chapter(chapter))
+
+        if len(data["data"]) < CHAPTER_LIMIT:
+            break
+    else:
+        # Ran out of pages with more to come, so only what's up to the last one is done with
+        if since is not None and data["data"]:
+            covered = datetime.fromisoformat(data["data"][-1]["attributes"]["publishAt"])
+
+            # More than all those pages published at the same moment would keep us stuck here, so step past them
+            if covered <= since:
+                logger.warning(f"Skipping chapters published at {covered}, too many to fetch at once")
+                covered = since + OVERLAP + timedelta(seconds=1)
+
+    if since is not None:
+        for found in chapters.values():
+            found.reverse()
+
+    return chapters, covered
+
+
+@dataclass
+class FetchResult:
+    chapters: dict[str, list[Chapter]]
+    # How far along each manga has been fetched, by MangaDex id, missing for anything whose batch failed
+    covered: dict[str, datetime]
+    # Whether anything was turned away, and how long we were asked to wait if so
+    failed: bool
+    retry_after: float | None
+    duration: float
+
+
+class ChapterFetcher:
+    """
+    Fetches batches of new chapters concurrently, paced to MangaDex's rate limit.
+
+    Each host gets a circuit breaker, so a run of errors or a 429 stops us calling it for a while,
+    rather than carrying on through the rest of the batches.
+    """
+
+    def __init__(self, rate: float = RATE_LIMIT, burst: int = RATE_LIMIT):
+        self._bucket = TokenBucket(rate, burst)
+        self._breakers: dict[str, CircuitBreaker] = {}
+
+    def breaker(self, url: str) -> CircuitBreaker:
+        return self._breakers.setdefault(urlparse(url).netloc, CircuitBreaker())
+
+    async def fetch(
+        self, session: aiohttp.ClientSession, batches: list[tuple[list[str], datetime | None]]
+    ) -> FetchResult:
+        breaker = self.breaker(BASE_URL)
+        chapters: dict[str, list[Chapter]] = {}
+        covered: dict[str, datetime] = {}
+        failed, after = False, None
+        started = time.monotonic()
+
+        async def fetch(ids: list[str], since: datetime | None):
+            nonlocal failed, after
+
+            if not breaker.allow():
+                failed = True
+                return
+
+            try:
+                found, until = await new_chapters(session, ids, since, self._bucket)
+            except Exception as e:
+                failed = True
+
+                if isinstance(e, aiohttp.ClientResponseError) and (e.status == 429 or e.status >= 500):
+                    logger.warning(f"MangaDex returned {e.status}, backing off")
+                    wait = retry_after(e.headers)
+                    after = max(after or 0, wait) if wait is not None else after
+                    breaker.failure(wait)
+                else:
+                    logger.error("Error getting new chapters", exc_info=e)
+                    breaker.failure()
+            else:
+                breaker.success()
+                chapters.update(found)
+                covered.update(dict.fromkeys(ids, until))
+
+        await asyncio.gather(*(fetch(ids, since) for ids, since in batches))
+
+        # However long the breaker's holding off for is the least we should wait
+        if (remaining := breaker.remaining) is not None:
+            after = max(after or 0, remaining)
+
+        return FetchResult(chapters, covered, failed, after, time.monotonic() - started)
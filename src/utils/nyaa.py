@@ -1,5 +1,17 @@
+import logging
+from collections import OrderedDict
+from typing import Callable, Iterable, TypeVar
 from urllib.parse import quote, urlencode
 
+import aiohttp
+
+from src.utils.feeds import FeedEntry, FeedPool
+from src.utils.http import TokenBucket
+
+T = TypeVar("T")
+
+logger = logging.getLogger(__name__)
+
 
 async def magnet(title: str, hash: str) -> str:
     """
@@ -21,3 +33,253 @@ async def magnet(title: str, hash: str) -> str:
         magnet_link += f"&{urlencode({'tr': tracker})}"
 
     return magnet_link
+
+
+# Length of the substrings subscriptions are indexed under
+NGRAM = 3
+
+
+class Matcher:
+    """
+    Routes feed entries to the Nyaa subscriptions whose match they satisfy.
+
+    This gives exactly the same results as `src.utils.search`, but each title is only
+    lowered once, and only checked against the subscriptions it shares a trigram with.
+    """
+
+    def __init__(self):
+        self._matches: dict[int, str] = {}
+        self._words: dict[int, tuple[str, ...]] = {}
+        # The trigram each subscription is filed under, None if it's too short to have one
+        self._keys: dict[int, str | None] = {}
+        self._index: dict[str, set[int]] = {}
+        # Subscriptions with no word long enough to index, these get checked against everything
+        self._unindexed: set[int] = set()
+
+    def __len__(self) -> int:
+        return len(self._matches)
+
+    def add(self, id: int, match: str):
+        if self._matches.get(id) == match:
+            return
+
+        self.remove(id)
+
+        words = tuple(word.lower() for word in match.split())
+        longest = max(words, key=len, default="")
+
+        self._matches[id] = match
+        self._words[id] = words
+
+        # Every word has to be a substring of the title, so any trigram of any word has to be in
+        #  the title as well. Using the longest word keeps the buckets as specific as possible.
+        if len(longest) < NGRAM:
+            self._keys[id] = None
+            self._unindexed.add(id)
+        else:
+            key = longest[:NGRAM]
+            self._keys[id] = key
+            self._index.setdefault(key, set()).add(id)
+
+    def remove(self, id: int):
+        if id not in self._matches:
+            return
+
+        del self._matches[id]
+        del self._words[id]
+        key = self._keys.pop(id)
+
+        if key is None:
+            self._unindexed.discard(id)
+            return
+
+        ids = self._index[key]
+        ids.discard(id)
+
+        if not ids:
+            del self._index[key]
+
+    def sync(self, subscriptions: Iterable[tuple[int, str]]):
+        """
+        Bring the index in line with the given (id, match) pairs, only touching what changed.
+        """
+        current = dict(subscriptions)
+
+        for id in self._matches.keys() - current.keys():
+            self.remove(id)
+
+        for id, match in current.items():
+            self.add(id, match)
+
+    def match(self, title: str) -> list[int]:
+        """
+        Get the ids of every subscription this title satisfies.
+        """
+        lowered = title.lower()
+        candidates = set(self._unindexed)
+
+        if self._index:
+            grams = {lowered[i : i + NGRAM] for i in range(len(lowered) - NGRAM + 1)}
+
+            for gram in grams.intersection(self._index):
+                candidates.update(self._index[gram])
+
+        return [id for id in candidates if all(word in lowered for word in self._words[id])]
+
+    def route(self, entries: Iterable[T], title: Callable[[T], str]) -> dict[int, list[T]]:
+        """
+        Group entries by the subscriptions they match, keeping the order they were given in.
+        """
+        routed: dict[int, list[T]] = {}
+
+        for entry in entries:
+            for id in self.match(title(entry)):
+                routed.setdefault(id, []).append(entry)
+
+        return routed
+
+
+# How many infohashes are remembered per subscription, comfortably more than fit on one feed page
+SEEN_LIMIT = 250
+
+
+class SeenSet:
+    """
+    The infohashes already handled for each subscription, newest last.
+
+    This is the in-memory side of the `nyaa_seen` table, bounded the same way,
+    so checking an entry never has to go to the database.
+    """
+
+    def __init__(self, limit: int = SEEN_LIMIT):
+        self._limit = limit
+        self._seen: dict[int, OrderedDict[str, None]] = {}
+
+    def known(self, id: int) -> bool:
+        """
+        Whether we have any history for this subscription at all.
+        """
+        return id in self._seen
+
+    def has(self, id: int, infohash: str) -> bool:
+        seen = self._seen.get(id)
+        return seen is not None and infohash in seen
+
+    def touch(self, id: int):
+        """
+        Mark a subscription as having history, even if nothing has matched it yet.
+        """
+        self._seen.setdefault(id, OrderedDict())
+
+    def add(self, id: int, infohash: str):
+        seen = self._seen.setdefault(id, OrderedDict())
+        seen[infohash] = None
+        seen.move_to_end(infohash)
+
+        while len(seen) > self._limit:
+            seen.popitem(last=False)
+
+    def retain(self, ids: Iterable[int]):
+        """
+        Drop everything for subscriptions that no longer exist.
+        """
+        for id in self._seen.keys() - set(ids):
+            del self._seen[id]
+
+
+SEARCH_URL = "https://nyaa.si/"
+
+# Most distinct matches searched for when filling a single gap
+BACKFILL_LIMIT = 25
+
+
+def merge_entries(*feeds: Iterable[FeedEntry]) -> list[FeedEntry]:
+    """
+    Combine several feeds into one, without duplicates, newest first.
+    """
+    merged: dict[str, FeedEntry] = {}
+
+    for entries in feeds:
+        for entry in entries:
+            merged.setdefault(entry.id, entry)
+
+    return sorted(merged.values(), key=lambda entry: entry.published or 0, reverse=True)
+
+
+class Planner:
+    """
+    Works out when the global feed has moved on by more than a page between two polls,
+    and fills the gap in with searches for the matches we care about.
+    """
+
+    def __init__(self, bucket: TokenBucket, limit: int = BACKFILL_LIMIT):
+        self._bucket = bucket
+        self._limit = limit
+        # The last page that was actually handled, and when the oldest entry on it was published
+        self._previous: set[str] = set()
+        self._since: float | None = None
+
+    def observe(self, entries: list[FeedEntry]) -> tuple[int, bool]:
+        """
+        Compare this page with the last one handled, returning how many of its entries weren't
+        on that one, and whether anything could have been published between the two without us seeing it.
+        """
+        ids = {entry.id for entry in entries}
+
+        # Everything newer than any entry we saw last time is on this page, so as long as one
+        #  of them is still here there's no gap. Checking all of them, rather than just the newest,
+        #  means a single deleted torrent doesn't set this off.
+        overflowed = bool(self._previous) and self._previous.isdisjoint(ids)
+
+        return (len(ids - self._previous) if self._previous else 0), overflowed
+
+    def handled(self, entries: list[FeedEntry]):
+        """
+        Record a page once the tick it came from has gone through, so the next one is compared against it.
+
+        Nothing is recorded for failed ticks, so the page after one is still checked for a gap.
+        """
+        self._previous = {entry.id for entry in entries}
+        self._since = min((entry.published for entry in entries if entry.published is not None), default=None)
+
+    async def backfill(
+        self, session: aiohttp.ClientSession, feeds: FeedPool, matches: Iterable[str]
+    ) -> list[FeedEntry]:
+        """
+        Search for each distinct match, so guilds sharing a match only cost one request between them.
+
+        Searches go back well before the gap, so only what was published since the oldest entry on
+        the last page handled is kept. Anything older was already seen, or is from before we started.
+        """
+        results: list[FeedEntry] = []
+        since = self._since
+
+        if since is None:
+            return results
+
+        distinct = sorted({match.lower() for match in matches})
+
+        if len(distinct) > self._limit:
+            logger.warning(f"Only backfilling {self._limit} of {len(distinct)} Nyaa matches")
+            distinct = distinct[: self._limit]
+
+        for match in distinct:
+            await self._bucket.acquire()
+
+            try:
+                async with session.get(SEARCH_URL, params={"page": "rss", "q": match}) as resp:
+                    if resp.status > 299:
+                        continue
+
+                    body = await resp.read()
+
+                results.extend(
+                    entry
+                    for entry in await feeds.parse(body)
+                    if entry.published is not None and entry.published >= since
+                )
+            except Exception as e:
+                logger.error(f"Error backfilling Nyaa match {match}", exc_info=e)
+                continue
+
+        return results
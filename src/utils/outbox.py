@@ -0,0 +1,272 @@
+import asyncio
+import enum
+import heapq
+import itertools
+import logging
+import time
+from dataclasses import dataclass, field
+
+import discord
+
+from src.utils.http import TokenBucket
+from src.utils.webhooks import WebhookCache
+
+logger = logging.getLogger(__name__)
+
+# Discord's limits on a single message
+MAX_EMBEDS = 10
+MAX_EMBED_CHARACTERS = 6000
+
+Channel = discord.TextChannel | discord.Thread
+
+
+def _retrieve(future: asyncio.Future):
+    # Nobody has to wait on a delivery, failures are logged either way
+    if not future.cancelled():
+        future.exception()
+
+
+def _split(embeds: list[discord.Embed]) -> list[list[discord.Embed]]:
+    """
+    Break embeds up into groups small enough to each go in one message.
+    """
+    chunks: list[list[discord.Embed]] = [[]]
+    characters = 0
+
+    for embed in embeds:
+        size = len(embed)
+
+        if chunks[-1] and (len(chunks[-1]) >= MAX_EMBEDS or characters + size > MAX_EMBED_CHARACTERS):
+            chunks.append([])
+            characters = 0
+
+        chunks[-1].append(embed)
+        characters += size
+
+    return chunks
+
+
+class Priority(enum.IntEnum):
+    HIGH = 0
+    NORMAL = 1
+    LOW = 2
+
+
+@dataclass
+class Outgoing:
+    content: str | None
+    embeds: list[discord.Embed]
+    file: discord.File | None
+    queued: float
+    delivered: asyncio.Future[discord.Message] = field(repr=False)
+
+
+@dataclass
+class OutboxMetrics:
+    # Messages actually sent, and how many queued ones they were made up of
+    sent: int = 0
+    coalesced: int = 0
+    failed: int = 0
+    # Seconds from being queued to being sent
+    latency_total: float = 0.0
+    latency_max: float = 0.0
+
+    def record(self, latencies: list[float]):
+        self.sent += 1
+        self.coalesced += len(latencies)
+        self.latency_total += sum(latencies)
+        self.latency_max = max(self.latency_max, *latencies)
+
+    @property
+    def latency_avg(self) -> float:
+        return self.latency_total / self.coalesced if self.coalesced else 0.0
+
+
+class Outbox:
+    """
+    Sends messages for the poll loops, so a slow or rate limited channel only holds up itself.
+
+    Each channel has its own queue and rate limit, and whatever's waiting on the same channel
+    with the same content is sent as one message, up to Discord's limits.
+    """
+
+    def __init__(self, webhooks: WebhookCache | None = None, workers: int = 4, rate: float = 1, burst: int = 5):
+        # Channels in webhook mode are posted to through those instead of as the bot
+        self._webhooks = webhooks
+        self._workers = workers
+        self._rate = rate
+        self._burst = burst
+        self._tasks: list[asyncio.Task] = []
+        # Channel ids with something waiting, each one is only ever in here (or being worked on) once
+        self._ready: asyncio.Queue[int] = asyncio.Queue()
+        self._scheduled: set[int] = set()
+        self._queues: dict[int, list[tuple[int, int, Outgoing]]] = {}
+        self._channels: dict[int, Channel] = {}
+        self._buckets: dict[int, TokenBucket] = {}
+        # Ties are broken by the order things were queued in
+        self._order = itertools.count()
+        self.metrics = OutboxMetrics()
+
+    @property
+    def depth(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self._workers)]
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+        for queue in self._queues.values():
+            for *_, message in queue:
+                message.delivered.cancel()
+
+        self._queues.clear()
+
+    def send(
+        self,
+        channel: Channel,
+        content: str | None = None,
+        *,
+        embed: discord.Embed | None = None,
+        embeds: list[discord.Embed] | None = None,
+        file: discord.File | None = None,
+        priority: Priority = Priority.NORMAL,
+    ) -> asyncio.Future:
+        """
+        Queue a message, the returned future is done once it's actually been sent, with what was sent.
+
+        More embeds than fit in one message are spread over as many as it takes, the file going with the first.
+        """
+        embeds = [*(embeds or []), *([embed] if embed is not None else [])]
+        queued = [
+            self._queue(channel, content, chunk, file if i == 0 else None, priority)
+            for i, chunk in enumerate(_split(embeds))
+        ]
+
+        if len(queued) == 1:
+            return queued[0]
+
+        delivered = asyncio.gather(*queued)
+        delivered.add_done_callback(_retrieve)
+        return delivered
+
+    def _queue(
+        self,
+        channel: Channel,
+        content: str | None,
+        embeds: list[discord.Embed],
+        file: discord.File | None,
+        priority: Priority,
+    ) -> asyncio.Future[discord.Message]:
+        delivered = asyncio.get_running_loop().create_future()
+        delivered.add_done_callback(_retrieve)
+
+        message = Outgoing(content, embeds, file, time.monotonic(), delivered)
+        heapq.heappush(self._queues.setdefault(channel.id, []), (priority, next(self._order), message))
+        self._channels[channel.id] = channel
+
+        if channel.id not in self._scheduled:
+            self._scheduled.add(channel.id)
+            self._ready.put_nowait(channel.id)
+
+        return delivered
+
+    def _take(self, queue: list[tuple[int, int, Outgoing]]) -> list[Outgoing]:
+        """
+        Pop the next message off, along with anything after it that can go out in the same one.
+        """
+        *_, first = heapq.heappop(queue)
+        batch = [first]
+
+        # Attachments are left alone, they'd need renaming to share a message
+        if first.file is not None:
+            return batch
+
+        embeds = len(first.embeds)
+        characters = sum(len(embed) for embed in first.embeds)
+
+        while queue:
+            *_, message = queue[0]
+            size = sum(len(embed) for embed in message.embeds)
+
+            if (
+                message.file is not None
+                or message.content != first.content
+                or embeds + len(message.embeds) > MAX_EMBEDS
+                or characters + size > MAX_EMBED_CHARACTERS
+            ):
+                break
+
+            heapq.heappop(queue)
+            batch.append(message)
+            embeds += len(message.embeds)
+            characters += size
+
+        return batch
+
+    async def _send(
+        self, channel: Channel, content: str | None, embeds: list[discord.Embed], file: discord.File | None
+    ) -> discord.Message:
+        if self._webhooks is not None and (message := await self._webhooks.send(channel, content, embeds, file)):
+            return message
+
+        if file is not None:
+            return await channel.send(content, embeds=embeds, file=file)
+        else:
+            return await channel.send(content, embeds=embeds)
+
+    async def _deliver(self, channel_id: int):
+        queue = self._queues[channel_id]
+        channel = self._channels[channel_id]
+        bucket = self._buckets.setdefault(channel_id, TokenBucket(self._rate, self._burst))
+
+        batch = self._take(queue)
+        embeds = [embed for message in batch for embed in message.embeds]
+
+        await bucket.acquire()
+
+        try:
+            sent = await self._send(channel, batch[0].content, embeds, batch[0].file)
+        except Exception as e:
+            self.metrics.failed += len(batch)
+            logger.error(f"Error sending to channel {channel_id}", exc_info=e)
+
+            for message in batch:
+                if not message.delivered.done():
+                    message.delivered.set_exception(e)
+
+            return
+
+        now = time.monotonic()
+        latencies = [now - message.queued for message in batch]
+        self.metrics.record(latencies)
+        logger.debug(
+            f"Sent {len(batch)} queued message(s) to channel {channel_id} after {max(latencies):.3f}s,"
+            f" {self.depth} still queued"
+        )
+
+        for message in batch:
+            if not message.delivered.done():
+                message.delivered.set_result(sent)
+
+    async def _work(self):
+        while True:
+            channel_id = await self._ready.get()
+
+            try:
+                await self._deliver(channel_id)
+            except Exception as e:
+                logger.error(f"Error in outbox worker for channel {channel_id}", exc_info=e)
+            finally:
+                # Back of the line if there's more, so one busy channel can't starve the rest
+                if self._queues.get(channel_id):
+                    self._ready.put_nowait(channel_id)
+                else:
+                    self._scheduled.discard(channel_id)
+                    self._queues.pop(channel_id, None)
+                    self._channels.pop(channel_id, None)
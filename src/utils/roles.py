@@ -0,0 +1,183 @@
+import asyncio
+import logging
+import os
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Iterable
+
+import discord
+
+logger = logging.getLogger(__name__)
+
+# Set NOTIFICATION_ROLES=subscription to give every Nyaa/Manga subscription its own role,
+#  rather than one shared role per guild that gets handed around on every post
+PER_SUBSCRIPTION = os.getenv("NOTIFICATION_ROLES", "shared").lower() == "subscription"
+
+
+def _retrieve(future: asyncio.Future):
+    # Whoever queued the post checks on it, failures are logged by the outbox either way
+    if not future.cancelled():
+        future.exception()
+
+
+def _settle(sent: asyncio.Future, delivered: asyncio.Future):
+    if delivered.done():
+        return
+
+    if sent.cancelled():
+        delivered.cancel()
+    elif (e := sent.exception()) is not None:
+        delivered.set_exception(e)
+    else:
+        delivered.set_result(sent.result())
+
+
+async def toggle_roles(member: discord.Member, add: Iterable[int], remove: Iterable[int]):
+    """
+    Give and take subscription roles as someone (un)follows things, in at most two requests.
+    """
+    guild = member.guild
+    to_add = [role for id in add if (role := guild.get_role(id)) is not None]
+    to_remove = [role for id in remove if (role := guild.get_role(id)) is not None]
+
+    if to_add:
+        await member.add_roles(*to_add)
+
+    if to_remove:
+        await member.remove_roles(*to_remove)
+
+
+class RoleSync:
+    """
+    Keeps a notification role's members in line with a set of users, only adding or removing
+    the role where it actually differs.
+    """
+
+    def __init__(self, concurrency: int = 5):
+        # The users each role was last synced to, keyed by role id
+        self._last: dict[int, frozenset[int]] = {}
+        self._locks: dict[int, asyncio.Lock] = {}
+        # Posts waiting on each role, and the task sending them
+        self._pending: dict[int, deque[tuple[frozenset[int], Callable[[], asyncio.Future], asyncio.Future]]] = {}
+        self._posting: dict[int, asyncio.Task[None]] = {}
+        # discord.py handles the rate limits themselves, this just stops us queueing hundreds of requests at once
+        self._slots = asyncio.Semaphore(concurrency)
+
+    async def _apply(self, member: discord.Member, role: discord.Role, add: bool) -> bool:
+        async with self._slots:
+            try:
+                if add:
+                    await member.add_roles(role)
+                else:
+                    await member.remove_roles(role)
+            except discord.HTTPException as e:
+                logger.error(f"Error updating {role.name} for {member.id}", exc_info=e)
+                return False
+
+        return True
+
+    async def sync(self, role: discord.Role, user_ids: Iterable[int]):
+        wanted = frozenset(user_ids)
+
+        # Consecutive posts for the same followers, nothing can have changed
+        if self._last.get(role.id) == wanted:
+            return
+
+        guild = role.guild
+        current = {member.id: member for member in role.members if member.id != guild.me.id}
+
+        to_add = [member for id in wanted - current.keys() if (member := guild.get_member(id)) is not None]
+        to_remove = [member for id, member in current.items() if id not in wanted]
+
+        results = await asyncio.gather(
+            *(self._apply(member, role, add=True) for member in to_add),
+            *(self._apply(member, role, add=False) for member in to_remove),
+        )
+
+        # Only remember this if it all went through, otherwise try again next time
+        if all(results):
+            self._last[role.id] = wanted
+        else:
+            self._last.pop(role.id, None)
+
+    async def ensure(
+        self, guild: discord.Guild, role_id: int | None, name: str, user_ids: Iterable[int]
+    ) -> discord.Role:
+        """
+        Get a subscription's own role, creating it (and handing it out to the followers) if it's missing.
+        """
+        role = guild.get_role(role_id) if role_id is not None else None
+
+        if role is None:
+            # Role names max out at 100 characters
+            role = await guild.create_role(name=name[:100])
+            await self.sync(role, user_ids)
+
+        return role
+
+    @asynccontextmanager
+    async def hold(self, role: discord.Role, user_ids: Iterable[int]) -> AsyncIterator[discord.Role]:
+        """
+        Sync the role, and keep anything else from changing it until the block is done with it.
+        """
+        lock = self._locks.setdefault(role.id, asyncio.Lock())
+
+        async with lock:
+            await self.sync(role, user_ids)
+            yield role
+
+    def post(self, role: discord.Role, user_ids: Iterable[int], send: Callable[[], asyncio.Future]) -> asyncio.Future:
+        """
+        Queue a post mentioning the role, to be sent once the role's been synced to `user_ids`.
+
+        Every role has a task sending its posts in order, holding the role until each has gone out,
+        so whoever's queueing them needn't wait. Posts in a row for the same users share the one
+        sync, and go to the outbox together, so it can put them in the same message.
+
+        Returns a future that's done once it's been sent, with what was sent.
+        """
+        delivered = asyncio.get_running_loop().create_future()
+        delivered.add_done_callback(_retrieve)
+
+        self._pending.setdefault(role.id, deque()).append((frozenset(user_ids), send, delivered))
+
+        if role.id not in self._posting:
+            self._posting[role.id] = asyncio.create_task(self._post(role))
+
+        return delivered
+
+    async def _post(self, role: discord.Role):
+        pending = self._pending[role.id]
+        run = []
+
+        try:
+            while pending:
+                users = pending[0][0]
+                run = []
+
+                while pending and pending[0][0] == users:
+                    run.append(pending.popleft())
+
+                try:
+                    async with self.hold(role, users):
+                        sent = [send() for _, send, _ in run]
+                        await asyncio.gather(*sent, return_exceptions=True)
+                except Exception as e:
+                    logger.error(f"Error posting to {role.name}", exc_info=e)
+
+                    for *_, delivered in run:
+                        if not delivered.done():
+                            delivered.set_exception(e)
+
+                    continue
+
+                for (*_, delivered), future in zip(run, sent):
+                    _settle(future, delivered)
+        finally:
+            # Only anything left over from being cancelled, nothing's been queued since the last look
+            for *_, delivered in [*run, *pending]:
+                if not delivered.done():
+                    delivered.cancel()
+
+            del self._pending[role.id]
+            del self._posting[role.id]
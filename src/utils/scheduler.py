@@ -0,0 +1,150 @@
+import os
+import random
+import time
+from dataclasses import dataclass
+from typing import Hashable, Iterable
+
+# How much longer to wait after each poll that turned up nothing
+IDLE_FACTOR = 1.5
+# How much longer to wait after each failed poll
+FAILURE_FACTOR = 2.0
+# Weight given to the newest gap between publishes when averaging them
+GAP_SMOOTHING = 0.3
+
+
+@dataclass
+class PollConfig:
+    minimum: float
+    maximum: float
+    jitter: float = 0.1
+
+    @classmethod
+    def from_env(cls, name: str, minimum: float, maximum: float) -> "PollConfig":
+        """
+        Read the bounds from `{name}_POLL_MIN` and `{name}_POLL_MAX`, falling back to the ones given.
+        """
+        return cls(
+            minimum=float(os.getenv(f"{name}_POLL_MIN", minimum)),
+            maximum=float(os.getenv(f"{name}_POLL_MAX", maximum)),
+        )
+
+
+@dataclass
+class _State:
+    interval: float
+    due: float = 0.0
+    last_published: float | None = None
+    # Smoothed number of seconds between polls that found something new
+    gap: float | None = None
+    # While expedited, polled every `expedited_every` seconds until something new turns up, or this passes
+    expedited_until: float | None = None
+    expedited_every: float = 0.0
+
+
+class AdaptiveSchedule:
+    """
+    Decides how often to poll each source (or series), based on how often it actually publishes.
+
+    Anything that just published is polled at the minimum interval, quiet ones back off towards
+    the maximum, and failures back off faster still. Every interval gets some jitter, so sources
+    that started together don't stay in lockstep.
+    """
+
+    def __init__(self, config: PollConfig):
+        self.config = config
+        self._states: dict[Hashable, _State] = {}
+
+    def _state(self, key: Hashable) -> _State:
+        return self._states.setdefault(key, _State(interval=self.config.minimum))
+
+    def _reschedule(self, state: _State, interval: float, now: float, wait: float = 0):
+        state.interval = min(max(interval, self.config.minimum), self.config.maximum)
+        jitter = random.uniform(1 - self.config.jitter, 1 + self.config.jitter)
+        # `wait` is a hard floor (like a Retry-After), so neither the maximum nor jitter can cut it short
+        state.due = now + max(state.interval * jitter, wait)
+
+    def due(self, key: Hashable) -> bool:
+        return self._state(key).due <= time.monotonic()
+
+    def delay(self, key: Hashable) -> float:
+        """
+        Seconds until this key should next be polled.
+        """
+        return max(self._state(key).due - time.monotonic(), 0)
+
+    def record(self, key: Hashable, new: int):
+        """
+        Record a successful poll that turned up `new` new items.
+        """
+        state = self._state(key)
+        now = time.monotonic()
+
+        if new:
+            state.expedited_until = None
+
+            if state.last_published is not None:
+                gap = now - state.last_published
+                state.gap = gap if state.gap is None else GAP_SMOOTHING * gap + (1 - GAP_SMOOTHING) * state.gap
+
+            state.last_published = now
+            self._reschedule(state, self.config.minimum, now)
+            return
+
+        # Still expecting something, so look again soon rather than backing off
+        if state.expedited_until is not None:
+            if now < state.expedited_until:
+                state.due = now + state.expedited_every
+                return
+
+            state.expedited_until = None
+
+        interval = state.interval * IDLE_FACTOR
+
+        # Don't drift much past how often this normally publishes, otherwise a busy feed
+        #  that goes quiet for a minute ends up being polled as if it were dead.
+        if state.gap is not None:
+            interval = min(interval, max(state.gap / 2, self.config.minimum))
+
+        self._reschedule(state, interval, now)
+
+    def failed(self, key: Hashable, retry_after: float | None = None):
+        """
+        Record a failed poll, honouring the upstream's Retry-After if it sent one, even past the maximum.
+        """
+        state = self._state(key)
+        now = time.monotonic()
+
+        # Still expecting something, so keep looking rather than backing off, short of a Retry-After
+        if state.expedited_until is not None and now < state.expedited_until:
+            state.due = now + max(state.expedited_every, retry_after or 0)
+            return
+
+        interval = state.interval * FAILURE_FACTOR
+
+        if retry_after is not None:
+            interval = max(interval, retry_after)
+
+        self._reschedule(state, interval, now, wait=retry_after or 0)
+
+    def expedite(self, key: Hashable, window: float = 0, every: float = 0):
+        """
+        Make something due straight away, when we've heard it's got something new some other way.
+
+        With a `window`, it's then polled every `every` seconds until a poll turns something new up,
+        or the window's over, in case it hadn't caught up yet when we heard.
+        """
+        state = self._state(key)
+        now = time.monotonic()
+        state.interval = self.config.minimum
+        state.due = now
+
+        if window:
+            state.expedited_until = now + window
+            state.expedited_every = every
+
+    def retain(self, keys: Iterable[Hashable]):
+        """
+        Drop the state of anything that's no longer being polled.
+        """
+        for key in self._states.keys() - set(keys):
+            del self._states[key]
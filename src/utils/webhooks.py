@@ -0,0 +1,167 @@
+import asyncio
+import logging
+
+import discord
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import insert
+
+from src import Session
+from src.models.database import FeedWebhook
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_NAME = "Himari Feeds"
+
+
+def _parent(channel: discord.TextChannel | discord.Thread) -> discord.TextChannel | None:
+    """
+    Webhooks live on the text channel, threads post through their parent's.
+    """
+    parent = channel.parent if isinstance(channel, discord.Thread) else channel
+    return parent if isinstance(parent, discord.TextChannel) else None
+
+
+class WebhookCache:
+    """
+    The channels that have feed posts go through a webhook, and the webhooks themselves.
+
+    This keeps busy feed channels off the bot's own per-channel rate limit, so they don't
+    get in the way of it answering commands there.
+    """
+
+    def __init__(self, client: discord.Client):
+        self._client = client
+        # Loaded from the database on first use, then kept in step with it
+        self._enabled: set[int] | None = None
+        self._webhooks: dict[int, discord.Webhook] = {}
+        self._lock = asyncio.Lock()
+
+    async def _load(self):
+        if self._enabled is not None:
+            return
+
+        async with Session() as db:
+            rows = (await db.scalars(sa.select(FeedWebhook))).all()
+
+        self._enabled = {row.channel_id for row in rows}
+
+        for row in rows:
+            if row.webhook_id is not None and row.token is not None:
+                self._webhooks[row.channel_id] = discord.Webhook.partial(row.webhook_id, row.token, client=self._client)
+
+    async def enable(self, guild_id: int, channel_id: int):
+        async with self._lock:
+            await self._load()
+
+            async with Session.begin() as db:
+                await db.execute(
+                    insert(FeedWebhook)
+                    .values(guild_id=guild_id, channel_id=channel_id)
+                    .on_conflict_do_nothing(index_elements=[FeedWebhook.channel_id])
+                )
+
+            assert self._enabled is not None
+            self._enabled.add(channel_id)
+
+    async def disable(self, channel_id: int):
+        async with self._lock:
+            await self._load()
+
+            async with Session.begin() as db:
+                await db.execute(sa.delete(FeedWebhook).where(FeedWebhook.channel_id == channel_id))
+
+            assert self._enabled is not None
+            self._enabled.discard(channel_id)
+            webhook = self._webhooks.pop(channel_id, None)
+
+        if webhook is not None:
+            try:
+                await webhook.delete(reason="Feed webhook mode turned off")
+            except discord.HTTPException as e:
+                logger.warning(f"Couldn't delete feed webhook for channel {channel_id}: {e!r}")
+
+    async def get(self, channel: discord.TextChannel | discord.Thread) -> discord.Webhook | None:
+        """
+        Get the webhook to post to this channel through, None if it isn't in webhook mode.
+        """
+        parent = _parent(channel)
+
+        if parent is None:
+            return None
+
+        async with self._lock:
+            await self._load()
+
+            assert self._enabled is not None
+            if parent.id not in self._enabled:
+                return None
+
+            webhook = self._webhooks.get(parent.id)
+
+            if webhook is not None:
+                return webhook
+
+            try:
+                webhook = await parent.create_webhook(name=WEBHOOK_NAME, reason="Feed posts")
+            except discord.Forbidden:
+                logger.warning(f"Missing permissions to create a feed webhook in channel {parent.id}")
+                return None
+
+            self._webhooks[parent.id] = webhook
+
+            async with Session.begin() as db:
+                await db.execute(
+                    sa.update(FeedWebhook)
+                    .where(FeedWebhook.channel_id == parent.id)
+                    .values(webhook_id=webhook.id, token=webhook.token)
+                )
+
+            return webhook
+
+    def forget(self, channel: discord.TextChannel | discord.Thread):
+        """
+        Drop a webhook that's stopped working, so a new one gets made next time.
+        """
+        parent = _parent(channel)
+
+        if parent is not None:
+            self._webhooks.pop(parent.id, None)
+
+    async def send(
+        self,
+        channel: discord.TextChannel | discord.Thread,
+        content: str | None,
+        embeds: list[discord.Embed],
+        file: discord.File | None,
+    ) -> discord.WebhookMessage | None:
+        """
+        Post through the channel's webhook, returning None if it should go through the bot instead.
+        """
+        webhook = await self.get(channel)
+
+        if webhook is None:
+            return None
+
+        kwargs = {}
+        if file is not None:
+            kwargs["file"] = file
+        if isinstance(channel, discord.Thread):
+            kwargs["thread"] = channel
+
+        user = self._client.user
+
+        try:
+            return await webhook.send(
+                content or discord.utils.MISSING,
+                embeds=embeds,
+                username=user.display_name if user is not None else WEBHOOK_NAME,
+                avatar_url=user.display_avatar.url if user is not None else None,
+                allowed_mentions=discord.AllowedMentions(everyone=False, users=False, roles=True),
+                wait=True,
+                **kwargs,
+            )
+        except discord.NotFound:
+            # Somebody deleted it, so go through the bot this time
+            logger.warning(f"Feed webhook for channel {channel.id} is gone, making a new one next time")
+            self.forget(channel)
+            return None
@@ -23,17 +23,18 @@ class DailyDone(discord.ui.Button):
         self.handler = handler
 
     async def callback(self, interaction: discord.Interaction):
-        with Session.begin() as db:
-            daily = db.execute(
+        async with Session.begin() as db:
+            daily = await db.scalar(
                 sa.select(Daily).where(Daily.creator_id == interaction.user.id)
-            ).scalar()
+            )
 
             if daily is None:
                 return await interaction.response.send_message(
                     content="You do not have a daily counter setup."
                 )
 
-            daily.timestamp = int(datetime.utcnow().timestamp())
+            timestamp = int(datetime.utcnow().timestamp())
+            daily.timestamp = timestamp
             db.add(daily)
 
         await interaction.response.send_message(
@@ -41,7 +42,7 @@ class DailyDone(discord.ui.Button):
         )
 
         cast(DailyView, self.view).stop()
-        self.handler.schedule()
+        await self.handler.schedule(interaction.user.id, timestamp)
 
 
 class DailyCancel(discord.ui.Button):
@@ -54,15 +55,17 @@ class DailyCancel(discord.ui.Button):
         self.handler = handler
 
     async def callback(self, interaction: discord.Interaction):
-        with Session.begin() as db:
-            db.execute(sa.delete(Daily).where(Daily.creator_id == interaction.user.id))
+        async with Session.begin() as db:
+            await db.execute(
+                sa.delete(Daily).where(Daily.creator_id == interaction.user.id)
+            )
 
         await interaction.response.send_message(
             content="Daily counter has been cancelled."
         )
 
         cast(DailyView, self.view).stop()
-        self.handler.schedule()
+        await self.handler.unschedule(interaction.user.id)
 
 
 class DailyView(discord.ui.View):
@@ -3,6 +3,7 @@ from __future__ import annotations
 import typing
 
 import discord
+import sqlalchemy as sa
 
 from src import Session
 from src.models.database import JNovel
@@ -35,8 +36,17 @@ class JNovelSelection(discord.ui.Select):
         story = next(filter(lambda m: m.id == _uuid, self.stories), None)
         assert story is not None
 
-        with Session.begin() as db:
-            db_story = db.get(JNovel, story.id)
+        async with Session.begin() as db:
+            # asyncpg won't coerce the series id into the integer primary key,
+            #  so look it up the same way the follow command does
+            db_story = (
+                await db.execute(
+                    sa.select(JNovel).filter(
+                        JNovel.series == story.id,
+                        JNovel.guild_id == interaction.guild.id,
+                    )
+                )
+            ).scalar_one_or_none()
 
             if db_story is not None:
                 await interaction.response.send_message(
@@ -9,6 +9,7 @@ import sqlalchemy as sa
 from src import Session
 from src.models.database import Manga, MangaFollower
 from src.utils.mangadex import MangadexManga
+from src.utils.roles import PER_SUBSCRIPTION, toggle_roles
 
 
 class MangaSelection(discord.ui.Select):
@@ -30,9 +31,11 @@ class MangaSelection(discord.ui.Select):
         manga = next(filter(lambda m: m.id == _uuid, self.mangas), None)
         assert manga is not None
 
-        with Session.begin() as db:
-            db_manga = db.execute(
-                sa.select(Manga).filter(Manga.mangadex_id == manga.id, Manga.guild_id == interaction.guild.id)
+        async with Session.begin() as db:
+            db_manga = (
+                await db.execute(
+                    sa.select(Manga).filter(Manga.mangadex_id == manga.id, Manga.guild_id == interaction.guild.id)
+                )
             ).scalar_one_or_none()
 
             if db_manga is not None:
@@ -80,39 +83,37 @@ class MangaSearch(discord.ui.View):
         return True
 
 
-def determine_followers(mangas: list[Manga], user_id: int) -> dict[Manga, bool]:
-    followers = {}
-
-    with Session.begin() as db:
-        for manga in mangas:
-            db_manga = db.get(Manga, manga.id)
-
-            if db_manga is None:
-                followers[manga] = False
-                continue
+async def determine_followers(mangas: list[Manga], user_id: int) -> set[int]:
+    """
+    Get which of these the user follows, in the one query.
+    """
+    ids = [item.id for item in mangas]
 
-            follower = next(filter(lambda f: f.user_id == user_id, db_manga.followers), None)
+    if not ids:
+        return set()
 
-            followers[manga] = follower is not None
+    async with Session() as db:
+        rows = await db.scalars(
+            sa.select(MangaFollower.manga_id).where(MangaFollower.user_id == user_id, MangaFollower.manga_id.in_(ids))
+        )
 
-    return followers
+        return set(rows)
 
 
 class MangaNotification(discord.ui.Select):
-    def __init__(self, mangas: list[Manga], user_id: int):
-        _mangas = determine_followers(mangas, user_id)
-
+    def __init__(self, mangas: list[Manga], user_id: int, followed: set[int]):
         options = [
             discord.SelectOption(
                 label=manga.title[:90],
                 value=str(manga.id),
-                default=follower,
+                default=manga.id in followed,
             )
-            for manga, follower in _mangas.items()
+            for manga in mangas
         ]
 
         self._selected_options = {option.value for option in options if option.default}
         self._owner = user_id
+        self._followed = followed
 
         super().__init__(
             placeholder="Manga",
@@ -130,23 +131,36 @@ class MangaNotification(discord.ui.Select):
         new_selected_options = set(self.values).difference(self._selected_options)
         unselected_options = self._selected_options.difference(self.values)
 
-        with Session.begin() as db:
+        async with Session.begin() as db:
             for option in new_selected_options:
-                manga = db.get(Manga, option)
-                assert manga is not None
+                db.add(MangaFollower(manga_id=int(option), user_id=interaction.user.id))
 
-                manga.followers.append(MangaFollower(user_id=interaction.user.id))
+            for option in unselected_options:
+                await db.execute(
+                    sa.delete(MangaFollower).where(
+                        MangaFollower.manga_id == int(option),
+                        MangaFollower.user_id == self._owner,
+                    )
+                )
 
-                db.add(manga)
+            # Followers with their own role per subscription get it handed out (or taken) straight away
+            roles: dict[int, int | None] = {}
 
-            for option in unselected_options:
-                manga = db.get(Manga, option)
-                assert manga is not None
+            if PER_SUBSCRIPTION:
+                changed = [int(option) for option in new_selected_options | unselected_options]
+                rows = await db.execute(sa.select(Manga.id, Manga.role_id).where(Manga.id.in_(changed)))
+                roles = {row.id: row.role_id for row in rows}
 
-                follower = next(filter(lambda f: f.user_id == self._owner, manga.followers), None)
-                assert follower is not None
+        if isinstance(interaction.user, discord.Member):
+            await toggle_roles(
+                interaction.user,
+                add=(id for option in new_selected_options if (id := roles.get(int(option)))),
+                remove=(id for option in unselected_options if (id := roles.get(int(option)))),
+            )
 
-                db.delete(follower)
+        # Keep the view's copy in sync, so paging back here shows the right defaults
+        self._followed.update(int(option) for option in new_selected_options)
+        self._followed.difference_update(int(option) for option in unselected_options)
 
         self._selected_options = set(self.values)
 
@@ -184,13 +198,14 @@ class MangaNotificationPrevious(discord.ui.Button):
 
 
 class MangaNotificationView(discord.ui.View):
-    def __init__(self, mangas: list[Manga], owner_id: int, page: int = 1):
+    def __init__(self, mangas: list[Manga], owner_id: int, followed: set[int], page: int = 1):
         super().__init__()
 
         self._page = page
         self._max = 25
         self._mangas = mangas
         self._owner = owner_id
+        self._followed = followed
 
         self.setup_items()
 
@@ -235,7 +250,7 @@ class MangaNotificationView(discord.ui.View):
     def setup_items(self):
         self.clear_items()
 
-        self.add_item(MangaNotification(self.mangas, self._owner))
+        self.add_item(MangaNotification(self.mangas, self._owner, self._followed))
 
         if self._page != 1:
             self.add_item(MangaNotificationPrevious(self))
@@ -1,49 +1,46 @@
 from __future__ import annotations
 
 import discord
+import sqlalchemy as sa
 
 from src import Session
 from src.models.database import Nyaa, NyaaFollower
+from src.utils.roles import PER_SUBSCRIPTION, toggle_roles
 
 
-def determine_followers(seeds: list[Nyaa], user_id: int) -> dict[Nyaa, bool]:
-    followers = {}
+async def determine_followers(seeds: list[Nyaa], user_id: int) -> set[int]:
+    """
+    Get which of these the user follows, in the one query.
+    """
+    ids = [item.id for item in seeds]
 
-    with Session.begin() as db:
-        for seed in seeds:
-            nyaa = db.get(Nyaa, seed.id)
+    if not ids:
+        return set()
 
-            if nyaa is None:
-                followers[seed] = False
-                continue
-
-            follower = next(
-                filter(lambda f: f.user_id == user_id, nyaa.followers), None
+    async with Session() as db:
+        rows = await db.scalars(
+            sa.select(NyaaFollower.nyaa_id).where(
+                NyaaFollower.user_id == user_id, NyaaFollower.nyaa_id.in_(ids)
             )
+        )
 
-            if follower is None:
-                followers[seed] = False
-            else:
-                followers[seed] = True
-
-    return followers
+        return set(rows)
 
 
 class NyaaNotification(discord.ui.Select):
-    def __init__(self, seeds: list[Nyaa], user_id: int):
-        follower_map = determine_followers(seeds, user_id)
-
+    def __init__(self, seeds: list[Nyaa], user_id: int, followed: set[int]):
         options = [
             discord.SelectOption(
                 label=manga.name[:90].title(),
                 value=str(manga.id),
-                default=follower,
+                default=manga.id in followed,
             )
-            for manga, follower in follower_map.items()
+            for manga in seeds
         ]
 
         self._selected_options = {option.value for option in options if option.default}
         self._owner = user_id
+        self._followed = followed
 
         super().__init__(
             placeholder="Nyaa",
@@ -64,25 +61,38 @@ class NyaaNotification(discord.ui.Select):
         new_selected_options = set(self.values).difference(self._selected_options)
         unselected_options = self._selected_options.difference(self.values)
 
-        with Session.begin() as db:
+        async with Session.begin() as db:
             for option in new_selected_options:
-                seed = db.get(Nyaa, option)
-                assert seed is not None
-
-                seed.followers.append(NyaaFollower(user_id=interaction.user.id))
-
-                db.add(seed)
+                db.add(NyaaFollower(nyaa_id=int(option), user_id=interaction.user.id))
 
             for option in unselected_options:
-                seed = db.get(Nyaa, option)
-                assert seed is not None
+                await db.execute(
+                    sa.delete(NyaaFollower).where(
+                        NyaaFollower.nyaa_id == int(option),
+                        NyaaFollower.user_id == self._owner,
+                    )
+                )
+
+            # Followers with their own role per subscription get it handed out (or taken) straight away
+            roles: dict[int, int | None] = {}
 
-                follower = next(
-                    filter(lambda f: f.user_id == self._owner, seed.followers), None
+            if PER_SUBSCRIPTION:
+                changed = [int(option) for option in new_selected_options | unselected_options]
+                rows = await db.execute(
+                    sa.select(Nyaa.id, Nyaa.role_id).where(Nyaa.id.in_(changed))
                 )
-                assert follower is not None
+                roles = {row.id: row.role_id for row in rows}
+
+        if isinstance(interaction.user, discord.Member):
+            await toggle_roles(
+                interaction.user,
+                add=(id for option in new_selected_options if (id := roles.get(int(option)))),
+                remove=(id for option in unselected_options if (id := roles.get(int(option)))),
+            )
 
-                db.delete(follower)
+        # Keep the view's copy in sync, so paging back here shows the right defaults
+        self._followed.update(int(option) for option in new_selected_options)
+        self._followed.difference_update(int(option) for option in unselected_options)
 
         self._selected_options = set(self.values)
 
@@ -120,13 +130,16 @@ class NyaaNotificationPrevious(discord.ui.Button):
 
 
 class NyaaNotificationView(discord.ui.View):
-    def __init__(self, seeds: list[Nyaa], owner_id: int, page: int = 1):
+    def __init__(
+        self, seeds: list[Nyaa], owner_id: int, followed: set[int], page: int = 1
+    ):
         super().__init__()
 
         self._page = page
         self._max = 25
         self._seeds = seeds
         self._owner = owner_id
+        self._followed = followed
 
         self.setup_items()
 
@@ -163,7 +176,7 @@ class NyaaNotificationView(discord.ui.View):
     def setup_items(self):
         self.clear_items()
 
-        self.add_item(NyaaNotification(self.seeds, self._owner))
+        self.add_item(NyaaNotification(self.seeds, self._owner, self._followed))
 
         if self._page != 1:
             self.add_item(NyaaNotificationPrevious(self))
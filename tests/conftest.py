@@ -0,0 +1,4 @@
+import os
+
+# src builds its engine on import, it's never connected to here
+os.environ.setdefault("DATABASE_URL", "postgresql://localhost/himari")
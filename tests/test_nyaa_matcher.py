@@ -0,0 +1,72 @@
+import random
+
+import pytest
+
+from src.utils import search
+from src.utils.nyaa import Matcher
+
+# Few enough letters that random words and titles actually overlap
+ALPHABET = "abcAB İı0 -["
+SEEDS = range(50)
+
+
+def _text(rng: random.Random, words: int, length: int) -> str:
+    return " ".join(
+        "".join(rng.choice(ALPHABET) for _ in range(rng.randint(1, length))) for _ in range(words)
+    )
+
+
+def _expected(subscriptions: dict[int, str], title: str) -> set[int]:
+    return {id for id, match in subscriptions.items() if search(title, match)}
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_match_agrees_with_search(seed: int):
+    rng = random.Random(seed)
+    subscriptions = {id: _text(rng, rng.randint(0, 3), 5) for id in range(40)}
+
+    matcher = Matcher()
+    matcher.sync(subscriptions.items())
+
+    for _ in range(200):
+        title = _text(rng, rng.randint(0, 6), 8)
+        assert set(matcher.match(title)) == _expected(subscriptions, title), title
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_match_agrees_with_search_after_changes(seed: int):
+    rng = random.Random(seed)
+    subscriptions: dict[int, str] = {}
+    matcher = Matcher()
+
+    for _ in range(100):
+        id = rng.randrange(20)
+        action = rng.random()
+
+        if action < 0.5:
+            subscriptions[id] = _text(rng, rng.randint(0, 3), 5)
+            matcher.add(id, subscriptions[id])
+        elif action < 0.8:
+            subscriptions.pop(id, None)
+            matcher.remove(id)
+        else:
+            subscriptions = {id: _text(rng, rng.randint(0, 3), 5) for id in rng.sample(range(20), 10)}
+            matcher.sync(subscriptions.items())
+
+        assert len(matcher) == len(subscriptions)
+
+        title = _text(rng, rng.randint(0, 6), 8)
+        assert set(matcher.match(title)) == _expected(subscriptions, title), title
+
+
+def test_route_keeps_entry_order():
+    matcher = Matcher()
+    matcher.sync([(1, "frieren 1080p"), (2, "frieren"), (3, "dungeon")])
+
+    entries = ["[Sub] Frieren - 01 (1080p)", "[Sub] Dungeon Meshi - 01", "[Sub] Frieren - 02 (720p)"]
+
+    assert matcher.route(entries, lambda entry: entry) == {
+        1: [entries[0]],
+        2: [entries[0], entries[2]],
+        3: [entries[1]],
+    }
@@ -0,0 +1,102 @@
+import asyncio
+import pathlib
+
+import pytest
+import sqlalchemy as sa
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+import src.extensions.mangadex
+import src.views.mangadex
+import src.views.nyaa
+from src.extensions.mangadex import load_follows
+from src.models.database import Base, Manga, MangaFollower, Nyaa, NyaaFollower
+from src.views.mangadex import determine_followers as manga_followers
+from src.views.nyaa import determine_followers as nyaa_followers
+
+USER_ID = 1
+TABLES = [Manga.__table__, MangaFollower.__table__, Nyaa.__table__, NyaaFollower.__table__]
+
+
+@pytest.fixture
+def database(tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch):
+    """
+    A sqlite database the code under test talks to, and a list every statement sent to it is added to.
+    """
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'test.db'}")
+    session = async_sessionmaker(bind=engine, expire_on_commit=False)
+    statements: list[str] = []
+
+    @sa.event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    for module in (src.extensions.mangadex, src.views.mangadex, src.views.nyaa):
+        monkeypatch.setattr(module, "Session", session)
+
+    yield engine, session, statements
+
+    asyncio.run(engine.dispose())
+
+
+async def _seed(engine, session, count: int) -> tuple[list[Manga], list[Nyaa]]:
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all, tables=TABLES)
+
+    async with session.begin() as db:
+        mangas = [
+            Manga(title=f"Manga {i}", mangadex_id=f"md-{i // 2}", guild_id=1, channel_id=1) for i in range(count)
+        ]
+        seeds = [
+            Nyaa(match=f"match {i}", name=f"Nyaa {i}", guild_id=1, channel_id=1, creator_id=USER_ID)
+            for i in range(count)
+        ]
+        db.add_all([*mangas, *seeds])
+        await db.flush()
+
+        for i, (manga, seed) in enumerate(zip(mangas, seeds)):
+            db.add_all([MangaFollower(user_id=user_id, manga_id=manga.id) for user_id in range(i % 3 + 1)])
+            db.add_all([NyaaFollower(user_id=user_id, nyaa_id=seed.id) for user_id in range(i % 3 + 1)])
+
+    return mangas, seeds
+
+
+@pytest.mark.parametrize("count", [1, 25])
+def test_determine_followers_is_one_query(database, count: int):
+    engine, session, statements = database
+
+    async def run():
+        mangas, seeds = await _seed(engine, session, count)
+        statements.clear()
+
+        followed = await manga_followers(mangas, USER_ID)
+        assert len(statements) == 1
+        assert followed == {manga.id for i, manga in enumerate(mangas) if i % 3 >= USER_ID}
+
+        statements.clear()
+
+        followed = await nyaa_followers(seeds, USER_ID)
+        assert len(statements) == 1
+        assert followed == {seed.id for i, seed in enumerate(seeds) if i % 3 >= USER_ID}
+
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize("count", [1, 25])
+def test_mangadex_snapshot_is_two_queries(database, count: int):
+    engine, session, statements = database
+
+    async def run():
+        await _seed(engine, session, count)
+        statements.clear()
+
+        follows = await load_follows()
+
+        # The manga, then every one of their followers at once
+        assert len(statements) == 2
+        assert sum(len(mangas) for mangas in follows.values()) == count
+        assert all(manga.mangadex_id == mangadex_id for mangadex_id, mangas in follows.items() for manga in mangas)
+        assert sum(len(manga.followers) for mangas in follows.values() for manga in mangas) == sum(
+            i % 3 + 1 for i in range(count)
+        )
+
+    asyncio.run(run())